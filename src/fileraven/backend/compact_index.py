@@ -0,0 +1,439 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Storage of the in-memory vectors: "float32" keeps Chroma's own index,
+# "float16", "int8" and "binary" use a CompactIndex next to it
+VECTOR_STORAGE = os.getenv("FILERAVEN_VECTOR_STORAGE", "float32")
+# Number of candidates per requested result that are rescored with full vectors
+RESCORE_FACTOR = int(os.getenv("FILERAVEN_RESCORE_FACTOR", "4"))
+
+STORAGE_TYPES = ("float16", "int8", "binary")
+
+# Rows per block of codes. Bounds the temporary memory of a search, the rows
+# copied when the index grows and the rows re-quantized when int8 scales widen
+_BLOCK_SIZE = 16384
+# Factor by which the range of an int8 block is widened beyond the values
+# that exceeded it, so that the block is rarely re-quantized again
+_WIDENING = 1.5
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class _Blocks:
+    """
+    Rows kept in blocks of _BLOCK_SIZE rows.
+
+    Appending only copies the last, partially filled block when its capacity
+    doubles, the filled blocks are never copied.
+    """
+
+    def __init__(self, row_shape: Tuple[int, ...], dtype):
+        self.row_shape = row_shape
+        self.dtype = dtype
+        self.blocks: List[np.ndarray] = []
+        self.size = 0
+
+    def append(self, rows: np.ndarray) -> None:
+        done = 0
+        while done < len(rows):
+            if self.size == len(self.blocks) * _BLOCK_SIZE:
+                self.blocks.append(np.empty((0,) + self.row_shape, self.dtype))
+            block = self.blocks[-1]
+            used = self.size - (len(self.blocks) - 1) * _BLOCK_SIZE
+            n = min(_BLOCK_SIZE - used, len(rows) - done)
+            if used + n > len(block):
+                capacity = min(_BLOCK_SIZE, max(2 * len(block), used + n))
+                grown = np.empty((capacity,) + self.row_shape, self.dtype)
+                grown[:used] = block[:used]
+                self.blocks[-1] = block = grown
+            block[used : used + n] = rows[done : done + n]
+            self.size += n
+            done += n
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        """The filled rows of each block"""
+        for i, block in enumerate(self.blocks):
+            yield block[: self.size - i * _BLOCK_SIZE]
+
+    def __getitem__(self, position: int):
+        return self.blocks[position // _BLOCK_SIZE][position % _BLOCK_SIZE]
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.nbytes for block in self.blocks)
+
+
+class CompactIndex:
+    """
+    Brute-force vector index over compact codes with full-precision rescoring.
+
+    Only the codes are held in memory: float16 (2 bytes per dimension), int8
+    with per-dimension scales (1 byte) or binary sign codes (1 bit). The full
+    float32 vectors are appended to a file on disk and memory-mapped to rescore
+    the best candidates, so results are ranked by exact squared L2 distance
+    like Chroma's default space. The ids are kept on disk as well, in memory
+    there is only their offset in the ids file (8 bytes per vector).
+
+    Codes are kept in blocks of _BLOCK_SIZE vectors, each int8 block with its
+    own scales, so adding vectors never copies or re-quantizes the filled
+    blocks.
+
+    Every search scans all codes, its cost grows linearly with the number of
+    vectors (about 2 ms per 1000 int8 or float16 vectors of dimension 384, a
+    tenth of that for binary). search_batch scores many queries in one scan at
+    a fraction of the cost per query; use it where queries come in groups.
+    With tens of millions of vectors a scan takes seconds, for such corpora
+    the float32 storage with Chroma's HNSW index answers faster.
+
+    Attributes:
+        path (Path): Directory holding the index files
+        storage (str): Code type, one of "float16", "int8" or "binary"
+        rescore_factor (int): Candidates rescored per requested result
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        storage: str = "int8",
+        rescore_factor: int = RESCORE_FACTOR,
+    ):
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown vector storage: {storage}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.storage = storage
+        self.rescore_factor = rescore_factor
+
+        # Start of each id in the ids file, followed by the end of the file
+        self._offsets = _Blocks((), np.int64)
+        self._offsets.append(np.zeros(1, dtype=np.int64))
+        self.dim: Optional[int] = None
+        self._codes: Optional[_Blocks] = None
+        # Largest absolute value per dimension of each int8 block
+        self._maxima: List[np.ndarray] = []
+        self._load()
+
+    @property
+    def _vectors_file(self) -> Path:
+        return self.path / "vectors.f32"
+
+    @property
+    def _ids_file(self) -> Path:
+        return self.path / "ids.txt"
+
+    @property
+    def _meta_file(self) -> Path:
+        return self.path / "index.json"
+
+    def _load(self) -> None:
+        """Load the id offsets and rebuild the codes from the full vectors on disk."""
+        if not self._meta_file.exists():
+            return
+        with open(self._meta_file) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        with open(self._ids_file, "rb") as f:
+            while True:
+                lengths = np.fromiter(
+                    (len(line) for line in islice(f, _BLOCK_SIZE)), dtype=np.int64
+                )
+                if not len(lengths):
+                    break
+                self._offsets.append(self._end_offset() + np.cumsum(lengths))
+        self._codes = self._new_codes()
+        vectors = self._full_vectors()
+        for start in range(0, len(vectors), _BLOCK_SIZE):
+            self._append_codes(np.asarray(vectors[start : start + _BLOCK_SIZE]))
+
+    def _end_offset(self) -> int:
+        return int(self._offsets[len(self._offsets) - 1])
+
+    def _new_codes(self) -> _Blocks:
+        if self.storage == "binary":
+            return _Blocks(((self.dim + 7) // 8,), np.uint8)
+        return _Blocks(
+            (self.dim,), np.float16 if self.storage == "float16" else np.int8
+        )
+
+    def _full_vectors(self) -> np.ndarray:
+        """Memory-map the full float32 vectors."""
+        if not len(self):
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(
+            self._vectors_file,
+            dtype=np.float32,
+            mode="r",
+            shape=(len(self), self.dim),
+        )
+
+    def _ids(self, positions: Sequence[int]) -> List[str]:
+        """Read the ids of the vectors at positions from the ids file"""
+        ids = []
+        with open(self._ids_file, "rb") as f:
+            for position in positions:
+                f.seek(self._offsets[position])
+                length = self._offsets[position + 1] - self._offsets[position]
+                ids.append(f.read(length - 1).decode())
+        return ids
+
+    @staticmethod
+    def _scales(maxima: np.ndarray) -> np.ndarray:
+        return np.where(maxima > 0, maxima / 127.0, 1.0).astype(np.float32)
+
+    def _encode(self, vectors: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+        if self.storage == "float16":
+            return vectors.astype(np.float16)
+        if self.storage == "int8":
+            return np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+        return np.packbits(vectors > 0, axis=1)
+
+    def _append_codes(self, vectors: np.ndarray) -> None:
+        """Encode vectors (whose full vectors are on disk) into the open block"""
+        done = 0
+        while done < len(vectors):
+            position = len(self._codes)
+            used = position % _BLOCK_SIZE
+            part = vectors[done : done + _BLOCK_SIZE - used]
+            scales = None
+            if self.storage == "int8":
+                maxima = np.abs(part).max(axis=0)
+                if not used:
+                    self._maxima.append(maxima)
+                elif np.any(maxima > self._maxima[-1]):
+                    # Values outside the range of the open block: re-quantize it
+                    self._maxima[-1] = np.maximum(self._maxima[-1], _WIDENING * maxima)
+                    filled = self._full_vectors()[position - used : position]
+                    self._codes.blocks[-1][:used] = self._encode(
+                        np.asarray(filled), self._scales(self._maxima[-1])
+                    )
+                scales = self._scales(self._maxima[-1])
+            self._codes.append(self._encode(part, scales))
+            done += len(part)
+
+    def add(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        """
+        Append vectors to the index.
+
+        Args:
+            ids: Unique ids of the vectors
+            embeddings: Full-precision vectors, all of the same dimension
+        """
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._codes = self._new_codes()
+            with open(self._meta_file, "w") as f:
+                json.dump({"dim": self.dim}, f)
+
+        with open(self._vectors_file, "ab") as f:
+            f.write(vectors.tobytes())
+        lines = [f"{id_}\n".encode() for id_ in ids]
+        with open(self._ids_file, "ab") as f:
+            f.writelines(lines)
+        lengths = np.fromiter((len(line) for line in lines), dtype=np.int64)
+        self._offsets.append(self._end_offset() + np.cumsum(lengths))
+        self._append_codes(vectors)
+
+    def _approximate_distances(
+        self, block: np.ndarray, scales: Optional[np.ndarray], queries: np.ndarray
+    ) -> np.ndarray:
+        """
+        Distances of the codes of a block to each query (one row per query),
+        on the scale of the code type.
+        """
+        if self.storage == "binary" and len(queries) == 1:
+            query_code = np.packbits(queries[0] > 0)
+            return _POPCOUNT[np.bitwise_xor(block, query_code)].sum(axis=1)[None, :]
+        if self.storage == "binary":
+            # Hamming distance of the sign bits, |a| + |q| - 2 a.q for 0/1 vectors
+            bits = np.unpackbits(block, axis=1, count=self.dim).astype(np.float32)
+            query_bits = (queries > 0).astype(np.float32)
+            return (
+                bits.sum(axis=1)
+                + query_bits.sum(axis=1)[:, None]
+                - 2 * query_bits @ bits.T
+            )
+        approx = block.astype(np.float32)
+        if scales is not None:
+            approx *= scales
+        return (
+            np.square(approx).sum(axis=1)
+            + np.square(queries).sum(axis=1)[:, None]
+            - 2 * queries @ approx.T
+        )
+
+    def search_batch(
+        self, queries: Sequence[Sequence[float]], n_results: int = 10
+    ) -> List[Tuple[List[str], List[float]]]:
+        """
+        Find the nearest vectors to each of the queries in a single scan of
+        the codes.
+
+        Returns:
+            List[Tuple[List[str], List[float]]]: ids and squared L2 distances,
+            nearest first, per query
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        if not len(self):
+            return [([], []) for _ in queries]
+        n_candidates = min(len(self), n_results * self.rescore_factor)
+
+        # Best candidates per query so far, merged with each block
+        best = np.empty((len(queries), 0), dtype=np.float32)
+        positions = np.empty((len(queries), 0), dtype=np.int64)
+        scales = map(self._scales, self._maxima) if self.storage == "int8" else None
+        for i, block in enumerate(self._codes):
+            distances = self._approximate_distances(
+                block, next(scales) if scales else None, queries
+            )
+            block_positions = np.arange(i * _BLOCK_SIZE, i * _BLOCK_SIZE + len(block))
+            best = np.concatenate([best, distances], axis=1)
+            positions = np.concatenate(
+                [positions, np.broadcast_to(block_positions, distances.shape)], axis=1
+            )
+            if best.shape[1] > n_candidates:
+                keep = np.argpartition(best, n_candidates - 1, axis=1)[:, :n_candidates]
+                best = np.take_along_axis(best, keep, axis=1)
+                positions = np.take_along_axis(positions, keep, axis=1)
+
+        # Rescore with the full vectors from disk
+        full = self._full_vectors()
+        results = []
+        for query, candidates in zip(queries, positions):
+            candidates = np.sort(candidates)
+            exact = np.square(np.asarray(full[candidates]) - query).sum(axis=1)
+            order = np.argsort(exact)[:n_results]
+            results.append(
+                (self._ids(candidates[order]), [float(exact[i]) for i in order])
+            )
+        return results
+
+    def search(
+        self, query: Sequence[float], n_results: int = 10
+    ) -> Tuple[List[str], List[float]]:
+        """
+        Find the nearest vectors to the query.
+
+        Returns:
+            Tuple[List[str], List[float]]: ids and squared L2 distances, nearest first
+        """
+        return self.search_batch([query], n_results)[0]
+
+    def memory_bytes(self) -> int:
+        """Memory held by the codes, the id offsets (and scales)."""
+        size = self._offsets.nbytes
+        size += self._codes.nbytes if self._codes is not None else 0
+        size += sum(maxima.nbytes for maxima in self._maxima)
+        return size
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+def recall_report(
+    embeddings: np.ndarray,
+    n_queries: int = 200,
+    n_results: int = 10,
+    rescore_factors: Sequence[int] = (1, 4, 10),
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Measure recall@n_results of each code type against exact search.
+
+    Queries are stored vectors with a small amount of noise added, so that
+    they are near, but not identical to, an indexed vector.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), n_queries)]
+    queries = queries + rng.normal(0, 0.05, queries.shape).astype(np.float32)
+
+    ids = [str(i) for i in range(len(embeddings))]
+    exact = [
+        set(np.argsort(np.square(embeddings - query).sum(axis=1))[:n_results])
+        for query in queries
+    ]
+
+    report = [
+        {
+            "storage": "float32",
+            "rescore_factor": None,
+            "bytes_per_vector": embeddings.shape[1] * 4,
+            "recall": 1.0,
+            "ms_per_query": None,
+        }
+    ]
+    for storage in STORAGE_TYPES:
+        for rescore_factor in rescore_factors:
+            with tempfile.TemporaryDirectory() as path:
+                index = CompactIndex(path, storage, rescore_factor)
+                index.add(ids, embeddings)
+                hits = 0
+                start = time.perf_counter()
+                for query, expected in zip(queries, exact):
+                    found, _ = index.search(query, n_results)
+                    hits += len(expected & {int(i) for i in found})
+                elapsed = time.perf_counter() - start
+                report.append(
+                    {
+                        "storage": storage,
+                        "rescore_factor": rescore_factor,
+                        "bytes_per_vector": index.memory_bytes() / len(index),
+                        "recall": hits / (n_results * len(queries)),
+                        "ms_per_query": 1000 * elapsed / len(queries),
+                    }
+                )
+    return report
+
+
+def main():
+    """Report recall vs memory of the compact vector storages on the stored corpus"""
+    import chromadb
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--path", default=".chroma", help="Chroma database path")
+    parser.add_argument(
+        "--storage",
+        default=VECTOR_STORAGE,
+        choices=("float32",) + STORAGE_TYPES,
+        help="Vector storage the corpus was ingested with",
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.storage == "float32":
+        client = chromadb.PersistentClient(path=args.path)
+        collection = client.get_collection("documents")
+        embeddings = np.asarray(collection.get(include=["embeddings"])["embeddings"])
+    else:
+        # Chroma only holds placeholders, the full vectors are in the index
+        index = CompactIndex(Path(args.path, f"compact-{args.storage}"), args.storage)
+        embeddings = np.array(index._full_vectors())
+
+    print(f"{len(embeddings)} vectors of dimension {embeddings.shape[1]}")
+    print(
+        f"{'storage':>8} {'rescore':>7} {'bytes/vec':>9} {'recall':>7} {'ms/query':>8}"
+    )
+    for row in recall_report(embeddings, args.queries, args.k):
+        print(
+            f"{row['storage']:>8} {row['rescore_factor'] or '-':>7} "
+            f"{row['bytes_per_vector']:>9.1f} {row['recall']:>7.3f} "
+            f"{row['ms_per_query'] or 0:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
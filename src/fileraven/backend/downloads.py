@@ -0,0 +1,160 @@
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+# Bytes read from disk per streamed chunk
+CHUNK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _etag(stat: os.stat_result) -> str:
+    """Stored files are never modified in place, mtime and size identify them"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match / If-Range header with the ETag"""
+    if header.strip() == "*":
+        return True
+    tags = (tag.strip().removeprefix("W/") for tag in header.split(","))
+    return etag in tags
+
+
+def _http_date(header: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _not_modified_since(header: Optional[str], stat: os.stat_result) -> bool:
+    since = _http_date(header)
+    return since is not None and int(stat.st_mtime) <= since
+
+
+def _content_disposition(filename: str) -> str:
+    """Attachment header, non-ASCII names are sent percent-encoded (RFC 6266)"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=UTF-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range.
+
+    Returns:
+        Optional[Tuple[int, int]]: Inclusive (first, last) byte, None if the header
+        cannot be served as one range (then the whole file is sent)
+
+    Raises:
+        ValueError: If the range is not satisfiable
+    """
+    match = _RANGE.fullmatch(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(0, size - length), size - 1
+    first = int(first)
+    if first >= size:
+        raise ValueError("Range not satisfiable")
+    if not last:
+        return first, size - 1
+    last = int(last)
+    if last < first:
+        # Invalid range, ignored
+        return None
+    return first, min(last, size - 1)
+
+
+def _read(path: Path, first: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(first)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: Path) -> Response:
+    """
+    Stream a file with support for conditional and range requests.
+
+    Answers If-None-Match / If-Modified-Since with 304 Not Modified and a
+    single byte range (honouring If-Range) with 206 Partial Content. The file
+    is read in chunks of CHUNK_SIZE bytes, never as a whole.
+
+    Args:
+        request: The request, for its conditional and range headers
+        path: The file to send
+
+    Returns:
+        Response: 200, 206, 304 or 416 response
+    """
+    stat = path.stat()
+    size = stat.st_size
+    etag = _etag(stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif _not_modified_since(request.headers.get("if-modified-since"), stat):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    headers["Content-Disposition"] = _content_disposition(path.name)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (
+        if_range is None
+        or _etag_matches(if_range, etag)
+        or _http_date(if_range) == int(stat.st_mtime)
+    ):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            _read(path, 0, size), media_type=media_type, headers=headers
+        )
+
+    first, last = byte_range
+    headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    headers["Content-Length"] = str(last - first + 1)
+    return StreamingResponse(
+        _read(path, first, last - first + 1),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
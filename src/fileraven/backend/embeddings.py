@@ -1,7 +1,37 @@
+import logging
+import os
 import re
-from typing import Dict, List
+import threading
+import time
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
 
-from sentence_transformers import SentenceTransformer
+from fileraven.backend import markdown_blocks
+from fileraven.backend.metrics import (
+    CHUNKING_SECONDS,
+    EMBEDDING_SECONDS,
+    TOKENIZATION_SECONDS,
+    record_span,
+    span,
+)
+
+logger = logging.getLogger(__name__)
+
+# Inference backend of the embedding model: "torch" or "onnx"
+EMBEDDING_BACKEND = os.getenv("FILERAVEN_EMBEDDING_BACKEND", "torch")
+ONNX_QUANTIZE = os.getenv("FILERAVEN_ONNX_QUANTIZE", "0").lower() in ("1", "true")
+ONNX_THREADS = int(os.getenv("FILERAVEN_ONNX_THREADS", "0")) or None
+
+# Number of chunks embedded and written to the vector store together
+EMBEDDING_BATCH_SIZE = int(os.getenv("FILERAVEN_EMBEDDING_BATCH_SIZE", "32"))
+
+
+class Chunk(NamedTuple):
+    """A chunk of text and the [start, end) character span it covers in the document"""
+
+    text: str
+    start: int
+    end: int
 
 
 class Embedder:
@@ -10,10 +40,15 @@ class Embedder:
     original markdown formatting for LLM context. Uses recursive semantic splitting
     and progressive merging with overlap.
 
+    An Embedder can be shared by threads: the calls of the tokenizer and the
+    model are serialized, as the fast tokenizers fail when they are used
+    concurrently with different truncation settings.
+
     Attributes:
         chunk_size (int): Maximum number of tokens per chunk
         overlap_size (int): Number of overlapping tokens between chunks
         model_name (str): Name of the embedding model to use
+        backend (str): Inference backend, "torch" (SentenceTransformer) or "onnx"
     """
 
     def __init__(
@@ -21,144 +56,285 @@ class Embedder:
         chunk_size: int = 228,
         overlap_size: int = 32,
         model_name: str = "all-MiniLM-L6-v2",
+        backend: str = EMBEDDING_BACKEND,
     ):
         self.chunk_size = chunk_size
         self.overlap_size = overlap_size
-        self.model = SentenceTransformer(model_name)
+        self.backend = backend
+        # Guards the tokenizer and the model
+        self._lock = threading.Lock()
+        # Set once the model has embedded a text, see warm_up
+        self.ready = False
+        if backend == "torch":
+            # Imported here, loading torch is not needed for the onnx backend
+            from sentence_transformers import SentenceTransformer
+
+            self.model = SentenceTransformer(model_name)
+        elif backend == "onnx":
+            from fileraven.backend.onnx_encoder import OnnxEncoder
+
+            self.model = OnnxEncoder(
+                model_name, quantize=ONNX_QUANTIZE, num_threads=ONNX_THREADS
+            )
+        else:
+            raise ValueError(f"Unknown embedding backend: {backend}")
 
     def _get_token_count(self, text: str) -> int:
         """Get the number of tokens in a text chunk."""
-        return len(self.model.tokenizer.encode(text))
+        with self._lock, TOKENIZATION_SECONDS.time():
+            return len(self.model.tokenizer.encode(text))
+
+    def _token_spans(self, text: str, tokens: list, size: int) -> List[Tuple[int, int]]:
+        """
+        Character spans of consecutive slices of size tokens, using the
+        offset mapping of fast tokenizers. Falls back to the whole text.
+        """
+        n_slices = (len(tokens) + size - 1) // size
+        try:
+            with self._lock:
+                offsets = self.model.tokenizer(text, return_offsets_mapping=True)[
+                    "offset_mapping"
+                ]
+        except (NotImplementedError, KeyError, TypeError):
+            return [(0, len(text))] * n_slices
+        if len(offsets) != len(tokens):
+            return [(0, len(text))] * n_slices
+
+        spans = []
+        last_end = 0
+        for start in range(0, len(tokens), size):
+            # Special tokens have empty offsets
+            covered = [o for o in offsets[start : start + size] if o[1] > o[0]]
+            if covered:
+                last_end = covered[-1][1]
+                spans.append((covered[0][0], last_end))
+            else:
+                spans.append((last_end, last_end))
+        return spans
 
-    def _emergency_split(self, text: str) -> List[str]:
+    def _emergency_split(self, text: str) -> List[Chunk]:
         """
         Split text into chunks if no semantic split is possible and chunk is too large.
         Tries to split at sentence boundaries first, then hard splits at token limit.
         """
         chunks = []
         current_chunk = ""
+        current_start = 0
         current_tokens = 0
 
+        def make_chunk(chunk_text: str, start: int) -> Chunk:
+            stripped = chunk_text.lstrip()
+            start += len(chunk_text) - len(stripped)
+            stripped = stripped.rstrip()
+            return Chunk(stripped, start, start + len(stripped))
+
         # Try to split at sentence boundaries first
         sentences = re.split(r"([.!?]\s+)", text)
 
+        position = 0
         for sentence in sentences:
+            sentence_start = position
+            position += len(sentence)
             sentence_tokens = self._get_token_count(sentence)
 
             if sentence_tokens > self.chunk_size:
                 # If a single sentence is too large, split by tokens
                 if current_chunk:
-                    chunks.append(current_chunk.strip())
+                    chunks.append(make_chunk(current_chunk, current_start))
                     current_chunk = ""
                     current_tokens = 0
 
                 # Encode and decode to maintain subword token boundaries
-                tokens = self.model.tokenizer.encode(sentence)
-                start = 0
-                while start < len(tokens):
-                    end = start + self.chunk_size
-                    chunk = self.model.tokenizer.decode(tokens[start:end])
-                    chunks.append(chunk.strip())
-                    start = end
+                with self._lock:
+                    tokens = self.model.tokenizer.encode(sentence)
+                spans = self._token_spans(sentence, tokens, self.chunk_size)
+                for (start, end), token_start in zip(
+                    spans, range(0, len(tokens), self.chunk_size)
+                ):
+                    with self._lock:
+                        chunk = self.model.tokenizer.decode(
+                            tokens[token_start : token_start + self.chunk_size]
+                        )
+                    chunks.append(
+                        Chunk(
+                            chunk.strip(),
+                            sentence_start + start,
+                            sentence_start + end,
+                        )
+                    )
 
             elif current_tokens + sentence_tokens > self.chunk_size:
-                chunks.append(current_chunk.strip())
+                chunks.append(make_chunk(current_chunk, current_start))
                 current_chunk = sentence
+                current_start = sentence_start
                 current_tokens = sentence_tokens
 
             else:
+                if not current_chunk:
+                    current_start = sentence_start
                 current_chunk += sentence
                 current_tokens += sentence_tokens
 
         if current_chunk:
-            chunks.append(current_chunk.strip())
+            chunks.append(make_chunk(current_chunk, current_start))
 
         return chunks
 
-    def _split_semantic(self, text: str) -> List[str]:
+    def encode(self, texts: List[str]) -> list:
+        """Embed texts with the model"""
+        with self._lock:
+            return list(self.model.encode(texts))
+
+    def warm_up(self) -> bool:
+        """
+        Embed a text once, so that the first upload does not pay for the
+        initialization of the model. Sets ready if it succeeds.
+
+        Returns:
+            bool: Whether the model could embed the text
+        """
+        try:
+            self.ready = len(self.encode(["warm up"])[0]) > 0
+        except Exception:
+            logger.exception("Embedding model failed")
+            self.ready = False
+        return self.ready
+
+    def _split_semantic(self, text: str, offset: int = 0) -> Iterator[Chunk]:
         """
         Split text into semantic chunks recursively using markdown structure.
-        Returns the smallest possible semantic chunks.
+        Yields the smallest possible semantic chunks with their position in
+        the document (text starts at offset). Each level of the block tree is
+        scanned in linear time by markdown_blocks.
         """
-        if not text.strip():
-            return []
+        stripped = text.strip()
+        if not stripped:
+            return
+        # Position of the stripped text in the document
+        stripped_start = offset + len(text) - len(text.lstrip())
 
         if self._get_token_count(text) <= self.chunk_size:
-            return [text.strip()]
-
-        # List of (pattern, is_separator) tuples
-        # is_separator determines if the pattern itself should be a separate chunk
-        split_patterns = [
-            (r"(?=^#{1,6}\s)", False),  # Headers
-            (r"(?:^|\n)```[\s\S]*?```", True),  # Code blocks
-            (
-                r"(?:(?:^|\n)\|[^\n]*\|\s*\n\|[-:\|\s]*\|\s*\n(?:\|[^\n]*\|\s*\n)*)",
-                True,
-            ),  # Tables
-            (
-                r"(?:(?:^|\n)(?:[-*+]|\d+\.)\s+(?:(?!\n(?:[-*+]|\d+\.)\s).)*)",
-                True,
-            ),  # Lists
-            (r"\n\n+", False),  # Paragraphs
-            (r"(?<=[:;.!?])\s+", False),  # Sentences
-        ]
-
-        for pattern, is_separator in split_patterns:
-            if is_separator:
-                # Split and keep separators as their own chunks
-                chunks = re.split(f"({pattern})", text, flags=re.MULTILINE)
-                if len(chunks) > 1:
-                    result = []
-                    for chunk in chunks:
-                        if chunk.strip():
-                            result.extend(self._split_semantic(chunk))
-                    return result
-            else:
-                # Split at pattern boundaries
-                chunks = re.split(pattern, text, flags=re.MULTILINE)
-                if len(chunks) > 1:
-                    result = []
-                    for chunk in chunks:
-                        if chunk.strip():
-                            result.extend(self._split_semantic(chunk))
-                    return result
+            yield Chunk(stripped, stripped_start, stripped_start + len(stripped))
+            return
+
+        for spans, is_separator in markdown_blocks.LEVELS:
+            pieces = markdown_blocks.split_spans(text, spans, is_separator)
+
+            # Look ahead until the split has produced two non-empty pieces
+            head = []
+            non_empty = []
+            for start, end in pieces:
+                head.append((start, end))
+                if text[start:end].strip():
+                    non_empty.append((start, end))
+                    if len(non_empty) == 2:
+                        break
+            if len(head) < 2:
+                continue
+            # A match covering the whole text (e.g. a single oversized code
+            # block) does not split anything; try the next pattern instead.
+            # A piece that only drops surrounding whitespace is descended into.
+            if non_empty == [(0, len(text))]:
+                continue
+
+            for start, end in chain(head, pieces):
+                piece = text[start:end]
+                if piece.strip():
+                    yield from self._split_semantic(piece, offset + start)
+            return
 
         # If no semantic split is possible and chunk is still too large
-        return self._emergency_split(text)
+        for chunk in self._emergency_split(stripped):
+            yield Chunk(
+                chunk.text, stripped_start + chunk.start, stripped_start + chunk.end
+            )
 
-    def _merge_chunks(self, chunks: List[str]) -> List[str]:
+    def _merge_chunks(self, chunks: Iterable[Chunk]) -> Iterator[Chunk]:
         """
         Merge semantic chunks until they reach chunk_size, using the last semantic
-        chunk as overlap with the next merged chunk.
+        chunk as overlap with the next merged chunk. A merged chunk spans the
+        document from its first to its last semantic chunk.
         """
-        if not chunks:
-            return []
-
-        merged_chunks = []
         current_chunks = []
+        current_counts = []
         current_tokens = 0
 
+        def merged() -> Chunk:
+            return Chunk(
+                "\n\n".join(chunk.text for chunk in current_chunks),
+                current_chunks[0].start,
+                current_chunks[-1].end,
+            )
+
         for chunk in chunks:
-            chunk_tokens = self._get_token_count(chunk)
+            chunk_tokens = self._get_token_count(chunk.text)
 
             # If adding this chunk would exceed chunk_size
             if current_tokens + chunk_tokens > self.chunk_size and current_chunks:
-                # Add current group as a chunk
-                merged_chunks.append("\n\n".join(current_chunks))
+                # Emit current group as a chunk
+                yield merged()
                 # Start new group with the last semantic chunk as overlap
                 current_chunks = [current_chunks[-1], chunk]
-                current_tokens = (
-                    self._get_token_count(current_chunks[-2]) + chunk_tokens
-                )
+                current_counts = [current_counts[-1], chunk_tokens]
+                current_tokens = sum(current_counts)
             else:
                 current_chunks.append(chunk)
+                current_counts.append(chunk_tokens)
                 current_tokens += chunk_tokens
 
-        # Add the remaining chunks
+        # Emit the remaining chunks
         if current_chunks:
-            merged_chunks.append("\n\n".join(current_chunks))
+            yield merged()
 
-        return merged_chunks
+    def iter_chunks(self, text: str) -> Iterator[Chunk]:
+        """
+        Yield the final (merged, overlapping) chunks of a markdown text while
+        walking it, without materializing all chunks at once. Positions refer
+        to the text as given.
+        """
+        stripped = text.strip()
+        offset = len(text) - len(text.lstrip())
+        for chunk in self._merge_chunks(self._split_semantic(stripped)):
+            yield Chunk(chunk.text, offset + chunk.start, offset + chunk.end)
+
+    def iter_embeddings(
+        self, text: str, batch_size: int = EMBEDDING_BATCH_SIZE
+    ) -> Iterator[Dict[str, list]]:
+        """
+        Transform markdown text into batches of chunks and their embeddings.
+        Memory use is bounded by batch_size rather than by the document size.
+
+        Args:
+            text (str): Input markdown text
+            batch_size (int): Number of chunks embedded and yielded together
+
+        Yields:
+            Dict with:
+                'chunks': List[str] - Original text chunks with overlap
+                'embeddings': List[List[float]] - Embeddings of the chunks
+                'spans': List[Tuple[int, int]] - Start and end of each chunk in text
+        """
+        chunks = self.iter_chunks(text)
+        chunking_time = 0.0
+        n_chunks = 0
+        while True:
+            start = time.perf_counter()
+            batch = list(islice(chunks, batch_size))
+            chunking_time += time.perf_counter() - start
+            if not batch:
+                break
+            n_chunks += len(batch)
+            texts = [chunk.text for chunk in batch]
+            with span("embedding", EMBEDDING_SECONDS):
+                embeddings = self.encode(texts)
+            yield {
+                "chunks": texts,
+                "embeddings": embeddings,
+                "spans": [(chunk.start, chunk.end) for chunk in batch],
+            }
+
+        record_span("chunking", chunking_time, CHUNKING_SECONDS)
+        logger.debug("Number of chunks: %d", n_chunks)
 
     def get_embeddings(self, text: str) -> Dict[str, List[float]]:
         """
@@ -171,23 +347,13 @@ class Embedder:
             Dict with:
                 'chunks': List[str] - Original text chunks with overlap
                 'embeddings': List[List[float]] - List of embeddings
+                'spans': List[Tuple[int, int]] - Start and end of each chunk in text
         """
-        # Clean and split into smallest semantic chunks
-        semantic_chunks = self._split_semantic(text.strip())
-
-        # Merge chunks with overlap
-        final_chunks = self._merge_chunks(semantic_chunks)
-
-        # Generate embeddings
-        embeddings = [self.model.encode(chunk) for chunk in final_chunks]
-
-        # for chunk in final_chunks:
-        #     print("----------------- CHUNK ---------------------")
-        #     print(chunk)
-
-        print(f"Number of chunks: {len(final_chunks)}")
-
-        return {"chunks": final_chunks, "embeddings": embeddings}
+        result = {"chunks": [], "embeddings": [], "spans": []}
+        for batch in self.iter_embeddings(text):
+            for key in result:
+                result[key].extend(batch[key])
+        return result
 
     def __call__(self, text: str) -> Dict[str, List[float]]:
         """Allow the class to be called directly to generate embeddings."""
@@ -2,7 +2,7 @@ import shutil
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 
 from fastapi import UploadFile
 
@@ -35,6 +35,31 @@ class FileClerk:
 
         return str(path), file_uuid
 
+    def locate(self, file_id: str) -> Optional[Path]:
+        """
+        Find a stored file by its unique identifier.
+
+        Args:
+            file_id: Identifier returned by store
+
+        Returns:
+            Optional[Path]: Path of the file, None if there is no such file
+        """
+        try:
+            file_id = str(uuid.UUID(file_id))
+        except ValueError:
+            return None
+        for directory in Path(self.base_dir).glob(f"*/*/{file_id}"):
+            for path in directory.iterdir():
+                if path.is_file():
+                    return path
+        return None
+
+    @staticmethod
+    def file_id(path: str) -> str:
+        """Unique identifier of a file from its storage path"""
+        return Path(path).parent.name
+
     def _generate_path(self, original_filename: str) -> Tuple[Path, str]:
         """Generate storage path preserving original filename"""
         now = datetime.now()
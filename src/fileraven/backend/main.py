@@ -1,18 +1,58 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
 import uvicorn
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 
 from fileraven.backend.document_processor import process_document
+from fileraven.backend.downloads import file_response
 from fileraven.backend.embeddings import Embedder
 from fileraven.backend.file_clerk import FileClerk
+from fileraven.backend.metrics import (
+    BYTES_INGESTED,
+    CONVERSION_SECONDS,
+    REGISTRY,
+    span,
+    trace,
+)
 from fileraven.backend.rag_engine import RAGEngine
 from fileraven.backend.vector_store import VectorStore
 
+logging.basicConfig(
+    level=os.getenv("FILERAVEN_LOG_LEVEL", "INFO"),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Uploads processed at the same time, further uploads wait for a free slot
+INGEST_CONCURRENCY = int(os.getenv("FILERAVEN_INGEST_CONCURRENCY", "4"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the LLM before the first question and keep it loaded
+    rag_engine.start_keep_warm()
+    # /ready reports the embedding model once it has embedded a text
+    await run_in_threadpool(embedder.warm_up)
+    yield
+    # commit chunks still waiting in the write buffer first, stopping the
+    # keep-warm ping may take a while
+    vector_store.close()
+    rag_engine.close()
+
+
 app = FastAPI(
     title="FileRaven API",
     description="API for the FileRaven document Q&A system",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -24,14 +64,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Collect trace spans per request if FILERAVEN_TRACE is set"""
+    with trace(f"{request.method} {request.url.path}"):
+        return await call_next(request)
+
+
 vector_store = VectorStore()
 rag_engine = RAGEngine()
 embedder = Embedder()
 file_clerk = FileClerk()
+# Bounds the threadpool workers held by uploads, which can block while the
+# write buffer is full, so that queries keep getting a worker
+ingest_slots = asyncio.Semaphore(INGEST_CONCURRENCY)
 
 
 class Query(BaseModel):
     question: str
+    session_id: Optional[str] = None
+
+
+def ingest_document(content: bytes, filename: str, storage_file_path: str):
+    """Convert a document, embed it and queue its chunks, returns the commits"""
+    with span("conversion", CONVERSION_SECONDS):
+        markdown_text = process_document(content, filename)
+
+    # keep the markdown, chunks reference it by character offsets
+    doc_id = vector_store.add_document(markdown_text)
+
+    # compute embeddings batch by batch and store them in the vector database
+    batches = embedder.iter_embeddings(markdown_text)
+    return vector_store.add_unique_embedding_batches(batches, storage_file_path, doc_id)
 
 
 @app.post("/upload")
@@ -43,29 +108,104 @@ async def upload_document(file: UploadFile = File(...)):
     await file.seek(0)
     # storage_file_path = ""
 
-    # read file content and transform to markdown
+    # read file content, the processing runs in the threadpool so that the
+    # event loop keeps serving other requests (and concurrent uploads can
+    # share commits of the write buffer)
     content = await file.read()
-    markdown_text = process_document(content, file.filename)
+    BYTES_INGESTED.inc(len(content))
+    async with ingest_slots:
+        commits = await run_in_threadpool(
+            ingest_document, content, file.filename, storage_file_path
+        )
+    del content
 
-    # compute embeddings and store in vector database
-    embeddings = embedder.get_embeddings(markdown_text)
-    vector_store.add_unique_embeddings(embeddings, storage_file_path)
+    # acknowledge only once the chunks are committed
+    await asyncio.gather(*(asyncio.wrap_future(commit) for commit in commits))
 
     return {"message": "Document processed successfully"}
 
 
 @app.post("/query")
-async def query(query: Query):
-    """Query the document database"""
+def query(query: Query):
+    """Query the document database, runs in the threadpool as it blocks"""
     context, sources = vector_store.search(query.question)
 
-    print(context)
     context_str = "\n----------\n".join(context)
     # sources_str = ", ".join(set(sources))
 
-    response = rag_engine.generate_response(query.question, context_str)
-
-    return {"response": response, "sources": sources}
+    response = rag_engine.generate_response(
+        query.question, context_str, session_id=query.session_id
+    )
+
+    # downloadable documents, each listed once
+    documents = {
+        file_clerk.file_id(source): os.path.basename(source)
+        for source in sources
+        if source
+    }
+
+    return {
+        "response": response,
+        "sources": sources,
+        "documents": [
+            {"id": file_id, "filename": filename}
+            for file_id, filename in documents.items()
+        ],
+    }
+
+
+@app.get("/documents/{file_id}/content")
+def document_content(file_id: str, request: Request):
+    """Download a stored document, supports range and conditional requests"""
+    path = file_clerk.locate(file_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return file_response(request, path)
+
+
+@app.get("/health")
+async def health():
+    """Liveness probe, the API process is up and serving requests"""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness probe, checks that the embedding model was warmed up at
+    startup, the Chroma database and Ollama. Responds with 503 if one of
+    them is not available.
+    """
+    try:
+        vector_store.client.heartbeat()
+        chroma = True
+    except Exception:
+        logger.exception("Chroma heartbeat failed")
+        chroma = False
+    ollama = rag_engine.status()
+
+    checks = {
+        "embedding_model": embedder.ready,
+        "chroma": chroma,
+        "ollama": ollama["reachable"],
+    }
+    body = {
+        "status": "ready" if all(checks.values()) else "unavailable",
+        "checks": checks,
+        "llm_loaded": ollama["model_loaded"],
+        "write_queue_depth": (
+            len(vector_store.buffer) if vector_store.buffer is not None else 0
+        ),
+    }
+    return JSONResponse(body, status_code=200 if all(checks.values()) else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Expose metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 def main():
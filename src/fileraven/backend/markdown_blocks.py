@@ -0,0 +1,229 @@
+"""
+Linear-time scanner for the markdown block structure used by the Embedder.
+
+The document is treated as a block tree with the levels headings, code
+fences, tables, lists, paragraphs and sentences. Each level is split by a
+single forward scan that only uses ``str.find`` and anchored character runs,
+so no input can trigger regex backtracking. Sentences are the exception, their
+regular expression cannot backtrack and is kept. The tree is expanded lazily:
+the Embedder only descends into a block if it is larger than a chunk.
+
+The boundaries are the same as those of the regular expressions the Embedder
+used before (kept in the comments of each scanner for reference), including
+their quirks such as list items ending at the end of their first line.
+"""
+
+import re
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Anchored runs of a single character class; they cannot backtrack
+_WHITESPACE_RUN = re.compile(r"\s*")
+_DIGIT_RUN = re.compile(r"\d*")
+_TABLE_SEPARATOR_RUN = re.compile(r"[-:|\s]*")
+_NEWLINE_RUN = re.compile(r"\n*")
+# Fixed-width lookbehind followed by a single character class
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[:;.!?])\s+")
+
+Span = Tuple[int, int]
+
+
+def _line_starts(text: str, pos: int, prefix: str) -> Iterator[Tuple[int, int]]:
+    """
+    Yield candidates for ``(?:^|\\n)prefix...`` at or after pos in the order
+    a regex search tries them, as (match start, block start) pairs.
+    """
+    if (pos == 0 or text[pos - 1] == "\n") and text.startswith(prefix, pos):
+        yield pos, pos
+    newline = text.find("\n" + prefix, pos)
+    while newline >= 0:
+        yield newline, newline + 1
+        newline = text.find("\n" + prefix, newline + 1)
+
+
+def _row_end(text: str, start: int) -> Optional[Tuple[int, int]]:
+    """
+    Match a table row ``\\|[^\\n]*\\|\\s*\\n`` at start (which holds a pipe).
+
+    Returns:
+        (end of the greedy match, end of the whitespace after the row) or None
+    """
+    line_end = text.find("\n", start)
+    if line_end < 0:
+        line_end = len(text)
+    closing = text.rfind("|", start + 1, line_end)
+    if closing < 0:
+        return None
+    run_end = _WHITESPACE_RUN.match(text, closing + 1).end()
+    newline = text.rfind("\n", closing + 1, run_end)
+    if newline < 0:
+        return None
+    return newline + 1, run_end
+
+
+def heading_spans(text: str) -> Iterator[Span]:
+    """Zero-width positions before headings, like ``(?=^#{1,6}\\s)``."""
+    for _, start in _line_starts(text, 0, "#"):
+        level = 0
+        while level < 7 and text.startswith("#", start + level):
+            level += 1
+        if level <= 6 and start + level < len(text) and text[start + level].isspace():
+            yield start, start
+
+
+def code_fence_spans(text: str) -> Iterator[Span]:
+    """Fenced code blocks, like ``(?:^|\\n)```[\\s\\S]*?```"""
+    pos = 0
+    while True:
+        candidate = next(_line_starts(text, pos, "```"), None)
+        if candidate is None:
+            return
+        match_start, start = candidate
+        closing = text.find("```", start + 3)
+        if closing < 0:
+            # Later fences cannot be closed either
+            return
+        yield match_start, closing + 3
+        pos = closing + 3
+
+
+def _table_end(text: str, start: int) -> Optional[int]:
+    """
+    Match a table at start, like
+    ``\\|[^\\n]*\\|\\s*\\n\\|[-:\\|\\s]*\\|\\s*\\n(?:\\|[^\\n]*\\|\\s*\\n)*``
+    """
+    # Header row, directly followed by the separator row
+    header = _row_end(text, start)
+    if header is None:
+        return None
+    _, separator_start = header
+    if not (
+        text[separator_start - 1] == "\n" and text.startswith("|", separator_start)
+    ):
+        return None
+
+    # Separator row: the last pipe of the [-:|\s] run followed by a newline
+    run_end = _TABLE_SEPARATOR_RUN.match(text, separator_start + 1).end()
+    closing = text.rfind("|", separator_start + 1, run_end)
+    while closing >= 0:
+        whitespace_end = _WHITESPACE_RUN.match(text, closing + 1).end()
+        newline = text.rfind("\n", closing + 1, whitespace_end)
+        if newline >= 0:
+            break
+        closing = text.rfind("|", separator_start + 1, closing)
+    else:
+        return None
+    end = newline + 1
+
+    # Body rows
+    while text.startswith("|", end):
+        row = _row_end(text, end)
+        if row is None:
+            break
+        end = row[0]
+    return end
+
+
+def table_spans(text: str) -> Iterator[Span]:
+    """Tables with header and separator row."""
+    pos = 0
+    while True:
+        for match_start, start in _line_starts(text, pos, "|"):
+            end = _table_end(text, start)
+            if end is not None:
+                break
+        else:
+            return
+        yield match_start, end
+        pos = end
+
+
+def _list_item_end(text: str, start: int) -> Optional[int]:
+    """
+    Match a list item at start, like
+    ``(?:[-*+]|\\d+\\.)\\s+(?:(?!\\n(?:[-*+]|\\d+\\.)\\s).)*``
+    """
+    if start >= len(text):
+        return None
+    if text[start] in "-*+":
+        marker_end = start + 1
+    else:
+        digits_end = _DIGIT_RUN.match(text, start).end()
+        if digits_end == start or not text.startswith(".", digits_end):
+            return None
+        marker_end = digits_end + 1
+
+    run_end = _WHITESPACE_RUN.match(text, marker_end).end()
+    if run_end == marker_end:
+        return None
+    line_end = text.find("\n", run_end)
+    return len(text) if line_end < 0 else line_end
+
+
+def list_spans(text: str) -> Iterator[Span]:
+    """List items (only the first line of each item)."""
+    pos = 0
+    while True:
+        for match_start, start in _line_starts(text, pos, ""):
+            end = _list_item_end(text, start)
+            if end is not None:
+                break
+        else:
+            return
+        yield match_start, end
+        pos = end
+
+
+def paragraph_spans(text: str) -> Iterator[Span]:
+    """Blank lines between paragraphs, like ``\\n\\n+``."""
+    start = text.find("\n\n")
+    while start >= 0:
+        end = _NEWLINE_RUN.match(text, start + 2).end()
+        yield start, end
+        start = text.find("\n\n", end)
+
+
+def sentence_spans(text: str) -> Iterator[Span]:
+    """Whitespace after sentence punctuation, like ``(?<=[:;.!?])\\s+``."""
+    # This regex cannot backtrack, and it is much faster than a scan in Python
+    for match in _SENTENCE_BOUNDARY.finditer(text):
+        yield match.span()
+
+
+# Levels of the block tree as (scanner, is_separator) tuples
+# is_separator determines if the matched block itself should be a separate chunk
+LEVELS: List[Tuple[Callable[[str], Iterator[Span]], bool]] = [
+    (heading_spans, False),
+    (code_fence_spans, True),
+    (table_spans, True),
+    (list_spans, True),
+    (paragraph_spans, False),
+    (sentence_spans, False),
+]
+
+
+def split_spans(
+    text: str, spans: Callable[[str], Iterator[Span]], is_separator: bool
+) -> Iterator[Span]:
+    """
+    Lazily split text at the spans of one level, equivalent to ``re.split``,
+    yielding (start, end) of each piece instead of the piece itself.
+    If is_separator is set, the matched text is yielded as its own piece.
+    """
+    last = 0
+    for start, end in spans(text):
+        yield last, start
+        if is_separator:
+            yield start, end
+        last = end
+    yield last, len(text)
+
+
+def split(
+    text: str, spans: Callable[[str], Iterator[Span]], is_separator: bool
+) -> Iterator[str]:
+    """
+    Lazily split text at the spans of one level, equivalent to ``re.split``.
+    If is_separator is set, the matched text is yielded as its own piece.
+    """
+    for start, end in split_spans(text, spans, is_separator):
+        yield text[start:end]
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Tuple
+
+import zstandard
+
+# Characters per independently compressed block
+BLOCK_CHARS = 64 * 1024
+# Number of documents kept memory-mapped
+MAX_OPEN_DOCUMENTS = int(os.getenv("FILERAVEN_MARKDOWN_CACHE", "64"))
+
+
+@contextmanager
+def _atomic_write(path: Path, mode: str) -> Iterator[IO]:
+    """
+    Write to a new temporary file next to path, which replaces path once it
+    is complete. Concurrent writers (also in other processes) each have
+    their own temporary file.
+    """
+    fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+
+class MarkdownStore:
+    """
+    Content-addressed store for the markdown of converted documents.
+
+    Each document is split into blocks of BLOCK_CHARS characters that are
+    compressed with zstd independently, so a character range can be read by
+    decompressing only the blocks it touches. Files are memory-mapped on read.
+    Documents are identified by the SHA-256 of their text, storing the same
+    document twice keeps a single copy.
+
+    Files are stored in a path pattern: base_dir/hash[:2]/hash.zst with the
+    block index in base_dir/hash[:2]/hash.json
+    """
+
+    def __init__(self, base_dir: str | Path = ".chroma/markdown", level: int = 3):
+        self.base_dir = Path(base_dir)
+        self.level = level
+        self._open: OrderedDict[str, Tuple[mmap.mmap, dict]] = OrderedDict()
+        # Guards the open documents, a closed mmap must not be read
+        self._lock = threading.Lock()
+        # Locks of the documents being written
+        self._writing: Dict[str, threading.Lock] = {}
+
+    def _paths(self, doc_id: str) -> Tuple[Path, Path]:
+        directory = self.base_dir / doc_id[:2]
+        return directory / f"{doc_id}.zst", directory / f"{doc_id}.json"
+
+    def put(self, text: str) -> str:
+        """
+        Store a markdown document.
+
+        Args:
+            text: The markdown text
+
+        Returns:
+            str: The document id
+        """
+        doc_id = hashlib.sha256(text.encode()).hexdigest()
+        _, index_path = self._paths(doc_id)
+        if index_path.exists():
+            return doc_id
+
+        # Concurrent uploads of the same document wait for the first to write it
+        with self._lock:
+            write_lock = self._writing.setdefault(doc_id, threading.Lock())
+        with write_lock:
+            if not index_path.exists():
+                self._write(doc_id, text)
+        with self._lock:
+            self._writing.pop(doc_id, None)
+        return doc_id
+
+    def _write(self, doc_id: str, text: str) -> None:
+        data_path, index_path = self._paths(doc_id)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        compressor = zstandard.ZstdCompressor(level=self.level)
+        offsets = [0]
+        with _atomic_write(data_path, "wb") as f:
+            for start in range(0, len(text), BLOCK_CHARS):
+                block = text[start : start + BLOCK_CHARS].encode()
+                offsets.append(offsets[-1] + f.write(compressor.compress(block)))
+
+        # The index is written last and marks the document as complete
+        index = {"length": len(text), "block_chars": BLOCK_CHARS, "offsets": offsets}
+        with _atomic_write(index_path, "w") as f:
+            json.dump(index, f)
+
+    def _get_open(self, doc_id: str) -> Tuple[mmap.mmap, dict]:
+        """Memory-map a document, keeping the most recently used ones open"""
+        if doc_id in self._open:
+            self._open.move_to_end(doc_id)
+            return self._open[doc_id]
+
+        data_path, index_path = self._paths(doc_id)
+        with open(index_path) as f:
+            index = json.load(f)
+        with open(data_path, "rb") as f:
+            if index["length"] == 0:
+                data = b""
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._open[doc_id] = (data, index)
+        if len(self._open) > MAX_OPEN_DOCUMENTS:
+            _, (old, _) = self._open.popitem(last=False)
+            if isinstance(old, mmap.mmap):
+                old.close()
+        return data, index
+
+    def length(self, doc_id: str) -> int:
+        """Number of characters of a document"""
+        with self._lock:
+            return self._get_open(doc_id)[1]["length"]
+
+    def slice(self, doc_id: str, start: int, end: int) -> str:
+        """
+        Read the characters [start, end) of a document.
+
+        Only the compressed blocks overlapping the range are decompressed.
+        """
+        with self._lock:
+            data, index = self._get_open(doc_id)
+            start = max(0, start)
+            end = min(index["length"], end)
+            if start >= end:
+                return ""
+
+            block_chars = index["block_chars"]
+            offsets: List[int] = index["offsets"]
+            first = start // block_chars
+            last = (end - 1) // block_chars
+            blocks = [data[offsets[i] : offsets[i + 1]] for i in range(first, last + 1)]
+
+        decompressor = zstandard.ZstdDecompressor()
+        text = "".join(decompressor.decompress(block).decode() for block in blocks)
+        base = first * block_chars
+        return text[start - base : end - base]
+
+    def get(self, doc_id: str) -> str:
+        """Read a whole document"""
+        return self.slice(doc_id, 0, self.length(doc_id))
+
+    def exists(self, doc_id: str) -> bool:
+        return self._paths(doc_id)[1].exists()
@@ -0,0 +1,292 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Enable per-request trace spans (logged when the request finishes)
+TRACING_ENABLED = os.getenv("FILERAVEN_TRACE", "0").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+SIZE_BUCKETS = tuple(float(2**i) for i in range(8, 22, 1))
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """
+    A monotonically increasing counter in the Prometheus text format.
+
+    Attributes:
+        name (str): Metric name
+        documentation (str): Help text shown in the exposition
+    """
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increase the counter by a non-negative amount."""
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {_format_value(self._value)}",
+        ]
+
+
+class Histogram:
+    """
+    A cumulative histogram in the Prometheus text format.
+
+    Attributes:
+        name (str): Metric name
+        documentation (str): Help text shown in the exposition
+        buckets (Sequence[float]): Upper bounds of the buckets
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record a single observation."""
+        with self._lock:
+            self._sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the wall-clock duration of the enclosed block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(
+                f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}'
+            )
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together at the /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONVERSION_SECONDS = REGISTRY.histogram(
+    "fileraven_conversion_seconds", "Time to convert an upload to markdown"
+)
+CHUNKING_SECONDS = REGISTRY.histogram(
+    "fileraven_chunking_seconds", "Time to split and merge markdown into chunks"
+)
+TOKENIZATION_SECONDS = REGISTRY.histogram(
+    "fileraven_tokenization_seconds",
+    "Time per tokenizer call",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+)
+EMBEDDING_SECONDS = REGISTRY.histogram(
+    "fileraven_embedding_seconds", "Time to embed the chunks of a document or query"
+)
+DEDUP_SECONDS = REGISTRY.histogram(
+    "fileraven_dedup_seconds", "Time to check new chunks against the collection"
+)
+SEARCH_SECONDS = REGISTRY.histogram(
+    "fileraven_vector_search_seconds", "Time to query the vector store"
+)
+PROMPT_SIZE_BYTES = REGISTRY.histogram(
+    "fileraven_prompt_size_bytes",
+    "Size of the prompt sent to the LLM",
+    buckets=SIZE_BUCKETS,
+)
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "fileraven_llm_time_to_first_token_seconds",
+    "Time until the LLM streams its first token",
+)
+LLM_TOTAL_SECONDS = REGISTRY.histogram(
+    "fileraven_llm_total_seconds", "Total time of an LLM generation"
+)
+LLM_PREFILL_SECONDS = REGISTRY.histogram(
+    "fileraven_llm_prefill_seconds",
+    "Time the LLM spent evaluating the prompt, as reported by Ollama",
+)
+LLM_LOAD_SECONDS = REGISTRY.histogram(
+    "fileraven_llm_load_seconds",
+    "Time Ollama spent loading the model before a generation",
+)
+LLM_PREFILL_TOKENS = REGISTRY.histogram(
+    "fileraven_llm_prefill_tokens",
+    "Prompt tokens evaluated by the LLM (tokens served from its cache excluded)",
+    buckets=tuple(float(2**i) for i in range(4, 16)),
+)
+CHUNKS_INGESTED = REGISTRY.counter(
+    "fileraven_chunks_ingested_total", "Number of chunks written to the vector store"
+)
+BYTES_INGESTED = REGISTRY.counter(
+    "fileraven_bytes_ingested_total", "Number of uploaded bytes processed"
+)
+
+
+# Trace spans of the current request as (name, start offset, duration) tuples
+_current_trace: ContextVar[Optional[List[Tuple[str, float, float]]]] = ContextVar(
+    "fileraven_trace", default=None
+)
+_trace_start: ContextVar[float] = ContextVar("fileraven_trace_start", default=0.0)
+
+
+@contextmanager
+def span(name: str, histogram: Optional[Histogram] = None) -> Iterator[None]:
+    """
+    Time a pipeline stage.
+
+    The duration is observed on ``histogram`` (if given) and, when tracing is
+    active for the current request, recorded as a trace span.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start, histogram, start)
+
+
+def record_span(
+    name: str,
+    duration: float,
+    histogram: Optional[Histogram] = None,
+    start: Optional[float] = None,
+) -> None:
+    """
+    Record an already measured stage duration, e.g. one accumulated over the
+    iterations of a generator. Without ``start`` the span is assumed to end now.
+    """
+    if histogram is not None:
+        histogram.observe(duration)
+    spans = _current_trace.get()
+    if spans is not None:
+        if start is None:
+            start = time.perf_counter() - duration
+        spans.append((name, start - _trace_start.get(), duration))
+
+
+@contextmanager
+def trace(request_name: str) -> Iterator[None]:
+    """Collect the spans of one request and log them when it finishes."""
+    if not TRACING_ENABLED:
+        yield
+        return
+    spans: List[Tuple[str, float, float]] = []
+    spans_token = _current_trace.set(spans)
+    start_token = _trace_start.set(time.perf_counter())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = time.perf_counter() - start
+        _current_trace.reset(spans_token)
+        _trace_start.reset(start_token)
+        logger.info(
+            "trace %s total=%.1fms %s",
+            request_name,
+            total * 1000,
+            " ".join(
+                f"{name}@{offset * 1000:.1f}ms+{duration * 1000:.1f}ms"
+                for name, offset, duration in spans
+            ),
+        )
@@ -0,0 +1,283 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_DIR = os.getenv("FILERAVEN_ONNX_DIR", ".onnx")
+
+_CONFIG_FILE = "fileraven_onnx.json"
+_MODEL_FILE = "model.onnx"
+_QUANTIZED_MODEL_FILE = "model_int8.onnx"
+
+
+def _hub_name(model_name: str) -> str:
+    """Resolve short names the same way SentenceTransformer does."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def export_model(model_name: str, export_dir: Union[str, Path]) -> Path:
+    """
+    Export the transformer of a SentenceTransformer model to ONNX.
+
+    Besides the ONNX graph, the fast tokenizer and the pooling configuration
+    are written to ``export_dir`` so that inference needs neither torch nor
+    sentence-transformers.
+
+    Args:
+        model_name: Name of the sentence-transformers model
+        export_dir: Directory to write the exported model to
+
+    Returns:
+        Path: The export directory
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize
+
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = model[1]
+    auto_model = transformer.auto_model.eval()
+
+    dummy = transformer.tokenizer(["FileRaven export"], return_tensors="pt")
+    input_names = list(dummy.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            (dict(dummy),),
+            str(export_dir / _MODEL_FILE),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    transformer.tokenizer.save_pretrained(str(export_dir))
+
+    config = {
+        "model_name": model_name,
+        "input_names": input_names,
+        "pooling": pooling.get_pooling_mode_str(),
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "max_seq_length": model.max_seq_length,
+    }
+    with open(export_dir / _CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=2)
+
+    return export_dir
+
+
+def quantize_model(export_dir: Union[str, Path]) -> Path:
+    """Write a dynamically int8-quantized copy of an exported model."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    export_dir = Path(export_dir)
+    quantized_path = export_dir / _QUANTIZED_MODEL_FILE
+    quantize_dynamic(
+        str(export_dir / _MODEL_FILE),
+        str(quantized_path),
+        weight_type=QuantType.QInt8,
+    )
+    return quantized_path
+
+
+class OnnxEncoder:
+    """
+    Run an exported sentence-transformers model with ONNX Runtime.
+
+    Provides the subset of the SentenceTransformer interface the Embedder
+    relies on: a ``tokenizer`` with ``encode``/``decode`` and an ``encode``
+    method returning numpy embeddings. The model is exported (and optionally
+    quantized) on first use and loaded from ``ONNX_DIR`` afterwards.
+
+    Attributes:
+        model_name (str): Name of the sentence-transformers model
+        quantize (bool): Use dynamic int8 quantization of the weights
+        num_threads (Optional[int]): Number of intra-op threads, None for the default
+        batch_size (int): Number of texts per inference call
+    """
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
+        batch_size: int = 32,
+        export_dir: Optional[Union[str, Path]] = None,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+
+        export_dir = Path(export_dir or Path(ONNX_DIR, _hub_name(model_name)))
+        if not (export_dir / _CONFIG_FILE).exists():
+            logger.info("Exporting %s to ONNX in %s", model_name, export_dir)
+            export_model(model_name, export_dir)
+        model_path = export_dir / _MODEL_FILE
+        if quantize:
+            model_path = export_dir / _QUANTIZED_MODEL_FILE
+            if not model_path.exists():
+                logger.info("Quantizing %s to int8", model_name)
+                quantize_model(export_dir)
+
+        with open(export_dir / _CONFIG_FILE) as f:
+            self.config = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(str(export_dir), use_fast=True)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Apply the pooling and normalization of the original model."""
+        mode = self.config["pooling"]
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        if mode == "cls":
+            pooled = hidden[:, 0]
+        elif mode == "max":
+            pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        elif mode == "mean":
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        else:
+            raise ValueError(f"Unsupported pooling mode: {mode}")
+
+        if self.config["normalize"]:
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            pooled = pooled / np.clip(norms, 1e-12, None)
+        return pooled
+
+    def encode(self, sentences: Union[str, List[str]]) -> np.ndarray:
+        """
+        Embed one text or a list of texts.
+
+        Args:
+            sentences: A single text or a list of texts
+
+        Returns:
+            np.ndarray: One embedding for a single text, a 2D array otherwise
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(
+                texts[start : start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.config["max_seq_length"],
+                return_tensors="np",
+            )
+            inputs = {
+                name: batch[name].astype(np.int64)
+                for name in self.config["input_names"]
+            }
+            hidden = self.session.run(["last_hidden_state"], inputs)[0]
+            embeddings.append(self._pool(hidden, batch["attention_mask"]))
+
+        if not embeddings:
+            return np.zeros((0, 0), dtype=np.float32)
+        result = np.concatenate(embeddings).astype(np.float32)
+        return result[0] if single else result
+
+
+def validate(
+    model_name: str,
+    texts: List[str],
+    quantize: bool = False,
+    num_threads: Optional[int] = None,
+) -> dict:
+    """
+    Compare ONNX embeddings with the PyTorch SentenceTransformer embeddings.
+
+    Returns:
+        dict: Cosine agreement statistics and the throughput of both backends
+    """
+    from sentence_transformers import SentenceTransformer
+
+    start = time.perf_counter()
+    reference_model = SentenceTransformer(model_name, device="cpu")
+    torch_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    onnx_model = OnnxEncoder(model_name, quantize=quantize, num_threads=num_threads)
+    onnx_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = reference_model.encode(texts, normalize_embeddings=True)
+    torch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candidate = onnx_model.encode(texts)
+    onnx_time = time.perf_counter() - start
+
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = (reference * candidate).sum(axis=1)
+
+    return {
+        "texts": len(texts),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "torch_load_seconds": torch_load,
+        "onnx_load_seconds": onnx_load,
+        "torch_texts_per_second": len(texts) / torch_time,
+        "onnx_texts_per_second": len(texts) / onnx_time,
+    }
+
+
+def main():
+    """Validate the ONNX backend against the PyTorch embeddings"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("texts", nargs="?", help="File with one text per line")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument(
+        "--min-cosine",
+        type=float,
+        default=0.99,
+        help="Fail if any text agrees less than this",
+    )
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts) as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = [
+            "FileRaven answers questions about your documents.",
+            "The quick brown fox jumps over the lazy dog.",
+            "| Quarter | Revenue |\n|---|---|\n| Q1 | 1.2M |",
+            "# Installation\n\nRun `pip install fileraven` to install the package.",
+        ] * 64
+
+    report = validate(args.model, texts, args.quantize, args.threads)
+    print(json.dumps(report, indent=2))
+    if report["cosine_min"] < args.min_cosine:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
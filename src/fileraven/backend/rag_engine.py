@@ -1,41 +1,289 @@
-import httpx
+import json
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import httpx
+
+from fileraven.backend.metrics import (
+    LLM_LOAD_SECONDS,
+    LLM_PREFILL_SECONDS,
+    LLM_PREFILL_TOKENS,
+    LLM_TOTAL_SECONDS,
+    LLM_TTFT_SECONDS,
+    PROMPT_SIZE_BYTES,
+    record_span,
+    span,
+)
 
 # Configure API client
 OLLAMA_URL = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Ollama model that answers the questions
+MODEL = os.getenv("FILERAVEN_MODEL", "llama3.2:1b")
+# How long Ollama keeps the model loaded after a request, e.g. "30m" or -1 (forever)
+KEEP_ALIVE = os.getenv("FILERAVEN_KEEP_ALIVE", "30m")
+# Interval of the background ping that keeps the model loaded, 0 disables it
+KEEP_WARM_SECONDS = float(os.getenv("FILERAVEN_KEEP_WARM_SECONDS", "240"))
+# Seconds a keep-warm ping may take, a ping that times out is retried later
+WARM_UP_TIMEOUT = 30.0
+# Seconds shutdown waits for a running keep-warm ping
+STOP_TIMEOUT = 5.0
+# Continue the conversation of a chat session from the context Ollama returns
+CARRY_CONTEXT = os.getenv("FILERAVEN_CARRY_CONTEXT", "0").lower() in ("1", "true")
+# Number of chat sessions whose context is kept
+MAX_SESSIONS = int(os.getenv("FILERAVEN_MAX_SESSIONS", "256"))
+# Context window of the model in tokens, sent with every request
+NUM_CTX = int(os.getenv("FILERAVEN_NUM_CTX", "4096"))
+
+# Kept at the start of every prompt, so that Ollama can reuse its evaluation
+INSTRUCTIONS = """Please answer the question at the end based on the context chunks (separated by dashes) below.
+If the answer is not stated in the context directly, try to infer it from the context stating that you did so.
+The answer should be short and concise.
+If the context doesn't contain relevant information, please say so."""
+
+logger = logging.getLogger(__name__)
+
+
+def _keep_alive_value(keep_alive: str) -> int | str:
+    """Ollama reads plain numbers as seconds, anything else as a duration"""
+    try:
+        return int(keep_alive)
+    except ValueError:
+        return keep_alive
+
 
 class RAGEngine:
-    def __init__(self):
+    """
+    Generates answers with Ollama.
+
+    Every prompt starts with the same instructions followed by the retrieved
+    context and the question, so the evaluation of the instructions can be
+    reused by Ollama's prompt cache. The model is kept loaded for keep_alive
+    after each request and, with start_keep_warm, by a periodic ping.
+
+    With carry_context, the context (the token state) Ollama returns is kept
+    per chat session and sent with the next question of the session. Follow-up
+    prompts then only contain the new context and question. Each turn adds its
+    retrieved context to the token state; once another turn of the same size
+    would no longer fit into num_ctx, the session starts over from a full
+    prompt, as Ollama would otherwise truncate the instructions at its front.
+
+    Attributes:
+        model (str): Ollama model name
+        keep_alive (str): How long Ollama keeps the model loaded
+        carry_context (bool): Continue chat sessions from their returned context
+        num_ctx (int): Context window of the model in tokens
+    """
+
+    def __init__(
+        self,
+        model: str = MODEL,
+        keep_alive: str = KEEP_ALIVE,
+        carry_context: bool = CARRY_CONTEXT,
+        num_ctx: int = NUM_CTX,
+    ):
         self.ollama_url = OLLAMA_URL + "/api/generate"
+        self.model = model
+        self.keep_alive = keep_alive
+        self.carry_context = carry_context
+        self.num_ctx = num_ctx
+        # Reuse connections to Ollama across requests
+        self.client = httpx.Client(timeout=600.0)
+        # Token state and tokens added by the last turn, per session
+        self._sessions: OrderedDict[str, Tuple[List[int], int]] = OrderedDict()
+        self._sessions_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._keep_warm_thread: Optional[threading.Thread] = None
+
+    def _session_context(self, session_id: Optional[str]) -> Optional[List[int]]:
+        if not (self.carry_context and session_id):
+            return None
+        with self._sessions_lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            context, turn_tokens = session
+            if len(context) + turn_tokens > self.num_ctx:
+                # The next turn would overflow the context window
+                logger.debug("Starting session %s over", session_id)
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return context
+
+    def _store_session_context(
+        self,
+        session_id: Optional[str],
+        context: Optional[List[int]],
+        previous: Optional[List[int]],
+    ) -> None:
+        if not (self.carry_context and session_id and context):
+            return
+        turn_tokens = len(context) - len(previous or [])
+        with self._sessions_lock:
+            self._sessions[session_id] = (context, turn_tokens)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+
+    @staticmethod
+    def _observe_stats(message: dict) -> None:
+        """Record the timings Ollama reports (in nanoseconds) with its last message"""
+        if "prompt_eval_duration" in message:
+            prefill = message["prompt_eval_duration"] / 1e9
+            record_span("llm_prefill", prefill, LLM_PREFILL_SECONDS)
+        if "load_duration" in message:
+            LLM_LOAD_SECONDS.observe(message["load_duration"] / 1e9)
+        if "prompt_eval_count" in message:
+            LLM_PREFILL_TOKENS.observe(message["prompt_eval_count"])
+        logger.debug(
+            "Ollama evaluated %s prompt tokens in %.3f s (load %.3f s)",
+            message.get("prompt_eval_count", 0),
+            message.get("prompt_eval_duration", 0) / 1e9,
+            message.get("load_duration", 0) / 1e9,
+        )
 
-    def generate_response(self, query: str, context: str):
+    def generate_response(
+        self, query: str, context: str, session_id: Optional[str] = None
+    ):
         """
         Generate response using Ollama with RAG context
+
+        Args:
+            query: The question
+            context: Retrieved context chunks
+            session_id: Id of the chat session, continues its conversation if
+                carry_context is enabled
         """
-        prompt = f"""Context: {context}
+        session_context = self._session_context(session_id)
+        if session_context:
+            prompt = f"Context: {context}\n\nQuestion: {query}"
+        else:
+            prompt = f"{INSTRUCTIONS}\n\nContext: {context}\n\nQuestion: {query}"
 
-Question: {query}
+        PROMPT_SIZE_BYTES.observe(len(prompt.encode()))
 
-Please provide a response based on the context chunks (separated by dashes) above.
-If the answer is not stated in the context directly, try to infer it from the context stating that you did so.
-The answer should be short and concise.
-If the context doesn't contain relevant information, please say so."""
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": _keep_alive_value(self.keep_alive),
+            "options": {"num_ctx": self.num_ctx},
+        }
+        if session_context:
+            payload["context"] = session_context
+
+        # Call Ollama API, streaming so that the time to first token is measurable
+        parts = []
+        start = time.perf_counter()
+        with span("llm", LLM_TOTAL_SECONDS):
+            with self.client.stream("POST", self.ollama_url, json=payload) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    message = json.loads(line)
+                    if not parts:
+                        LLM_TTFT_SECONDS.observe(time.perf_counter() - start)
+                    parts.append(message.get("response", ""))
+                    if message.get("done"):
+                        self._observe_stats(message)
+                        self._store_session_context(
+                            session_id, message.get("context"), session_context
+                        )
+                        break
+
+        logger.debug("Ollama responded with %d parts", len(parts))
+
+        return "".join(parts)
+
+    def warm_up(self, timeout: float = WARM_UP_TIMEOUT) -> bool:
+        """
+        Load the model (or keep it loaded) without generating anything.
+
+        Args:
+            timeout: Seconds to wait for Ollama
 
-        # print(prompt)
-
-        # Call Ollama API
-        response = httpx.post(
-            self.ollama_url,
-            json={
-                # "model": "llama3.2",
-                # "model": "mistral-cpu",
-                "model": "llama3.2:1b",
-                "prompt": prompt,
-                "stream": False,
-            },
-            timeout=600.0,
+        Returns:
+            bool: Whether Ollama could be reached
+        """
+        try:
+            response = self.client.post(
+                self.ollama_url,
+                json={
+                    "model": self.model,
+                    "keep_alive": _keep_alive_value(self.keep_alive),
+                    # A different num_ctx than in generate would reload the model
+                    "options": {"num_ctx": self.num_ctx},
+                },
+                timeout=timeout,
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as error:
+            logger.warning("Keeping %s loaded failed: %s", self.model, error)
+            return False
+        return True
+
+    def status(self, timeout: float = 2.0) -> dict:
+        """
+        Check whether Ollama is reachable and the model is loaded.
+
+        Returns:
+            dict: "reachable" and "model_loaded" flags
+        """
+        try:
+            response = self.client.get(OLLAMA_URL + "/api/ps", timeout=timeout)
+            response.raise_for_status()
+            models = response.json().get("models", [])
+        except (httpx.HTTPError, ValueError):
+            return {"reachable": False, "model_loaded": False}
+        model = self.model if ":" in self.model else f"{self.model}:latest"
+        loaded = {m.get("name") for m in models} | {m.get("model") for m in models}
+        return {"reachable": True, "model_loaded": model in loaded}
+
+    def _keep_warm(self, interval: float) -> None:
+        while True:
+            self.warm_up()
+            if self._stop.wait(interval):
+                return
+
+    def start_keep_warm(self, interval: float = KEEP_WARM_SECONDS) -> None:
+        """Load the model now and ping Ollama every interval seconds"""
+        if interval <= 0 or self._keep_warm_thread is not None:
+            return
+        self._stop.clear()
+        self._keep_warm_thread = threading.Thread(
+            target=self._keep_warm,
+            args=(interval,),
+            name="fileraven-keep-warm",
+            daemon=True,
         )
+        self._keep_warm_thread.start()
 
-        print(response)
+    def stop_keep_warm(self, timeout: float = STOP_TIMEOUT) -> bool:
+        """
+        Stop the keep-warm ping, waiting at most timeout seconds for a ping
+        that is running.
+
+        Returns:
+            bool: Whether the ping has stopped
+        """
+        self._stop.set()
+        if self._keep_warm_thread is None:
+            return True
+        self._keep_warm_thread.join(timeout)
+        if self._keep_warm_thread.is_alive():
+            logger.warning("Keep-warm ping still running, not waiting for it")
+            return False
+        self._keep_warm_thread = None
+        return True
 
-        return response.json()["response"]
+    def close(self) -> None:
+        """Stop the keep-warm ping and close the connections to Ollama"""
+        if self.stop_keep_warm():
+            # Closing the client would fail a ping that is still running,
+            # its daemon thread ends with the process instead
+            self.client.close()
@@ -1,32 +1,326 @@
+import logging
+import os
+import threading
 import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import chromadb
+import numpy as np
+from chromadb.utils import embedding_functions
+
+from fileraven.backend.compact_index import STORAGE_TYPES, VECTOR_STORAGE, CompactIndex
+from fileraven.backend.markdown_store import MarkdownStore
+from fileraven.backend.metrics import (
+    CHUNKS_INGESTED,
+    DEDUP_SECONDS,
+    SEARCH_SECONDS,
+    span,
+)
+from fileraven.backend.write_buffer import WRITE_BUFFER, Record, WriteBuffer
+
+logger = logging.getLogger(__name__)
+
+# Characters of neighbouring document text added on both sides of a result
+CONTEXT_CHARS = int(os.getenv("FILERAVEN_CONTEXT_CHARS", "0"))
+# Chunks copied at once when a compact storage is filled from the float32 one
+BACKFILL_BATCH = 1024
 
 
 class VectorStore:
-    def __init__(self):
+    """
+    Stores chunks with their embeddings and searches them.
+
+    With the default "float32" storage Chroma holds and indexes the vectors.
+    With "float16", "int8" or "binary" storage the vectors are searched in a
+    CompactIndex and Chroma only keeps documents and metadata (with a
+    one-dimensional placeholder embedding, as Chroma requires one per record).
+
+    Each storage has its own collection. A compact storage that is used for
+    the first time is filled with the chunks of the float32 collection;
+    chunks ingested with another compact storage are not carried over (a
+    warning is logged).
+
+    The markdown of each document is kept compressed in a MarkdownStore.
+    Chunks added with a doc_id only store their (doc_id, start, end) span as
+    metadata; their text is read from the store for the final results only.
+
+    With the write buffer enabled, adds are queued and committed in groups
+    by a background thread. The add methods return a Future that completes
+    once the chunks are committed; queued chunks are already visible to
+    search and dedup.
+
+    Attributes:
+        storage (str): Vector storage type
+    """
+
+    def __init__(self, storage: str = VECTOR_STORAGE, buffered: bool = WRITE_BUFFER):
+        self.storage = storage
         self.client = chromadb.PersistentClient(path=".chroma")
-        self.collection = self.client.get_or_create_collection("documents")
+        self.markdown_store = MarkdownStore(Path(".chroma", "markdown"))
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        if storage == "float32":
+            self.index = None
+        else:
+            self.index = CompactIndex(Path(".chroma", f"compact-{storage}"), storage)
+        self.collection = self.client.get_or_create_collection(
+            self._collection_name(storage)
+        )
+        # Guards the compact index, which is written by the buffer thread
+        self._lock = threading.Lock()
+        if self.index is not None and len(self.index) == 0:
+            self._backfill()
+        self._warn_other_storages()
+        self.buffer = WriteBuffer(self._commit) if buffered else None
+
+    @staticmethod
+    def _collection_name(storage: str) -> str:
+        return "documents" if storage == "float32" else f"documents-{storage}"
+
+    def _backfill(self):
+        """Copy the chunks of the float32 collection into a new compact storage"""
+        source = self.client.get_or_create_collection("documents")
+        total = source.count()
+        if not total:
+            return
+        logger.warning(
+            "Copying %d chunks into the new %s vector storage", total, self.storage
+        )
+        for offset in range(0, total, BACKFILL_BATCH):
+            batch = source.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=BACKFILL_BATCH,
+                offset=offset,
+            )
+            self._commit(
+                [
+                    Record(id_, embedding, document, metadata)
+                    for id_, embedding, document, metadata in zip(
+                        batch["ids"],
+                        batch["embeddings"],
+                        batch["documents"],
+                        batch["metadatas"],
+                    )
+                ]
+            )
+
+    def _warn_other_storages(self):
+        """Warn if chunks of another storage are not searched with this one"""
+        count = self.collection.count()
+        for storage in ("float32",) + STORAGE_TYPES:
+            if storage == self.storage:
+                continue
+            try:
+                other = self.client.get_collection(self._collection_name(storage))
+            except Exception:
+                continue
+            if other.count() > count:
+                logger.warning(
+                    "%d chunks are stored with %s vector storage, only %d with %s."
+                    " Chunks ingested with other storages are not searched.",
+                    other.count(),
+                    storage,
+                    count,
+                    self.storage,
+                )
+
+    def _add(
+        self,
+        ids: List[str],
+        embeddings: list,
+        documents: Optional[List[str]],
+        metadatas: List[dict],
+    ) -> Future:
+        """Queue records for the next commit, or commit them right away"""
+        records = [
+            Record(id_, embedding, document, metadata)
+            for id_, embedding, document, metadata in zip(
+                ids, embeddings, documents or [None] * len(ids), metadatas
+            )
+        ]
+        if self.buffer is not None and records:
+            return self.buffer.add(records)
+
+        future = Future()
+        if records:
+            self._commit(records)
+        future.set_result(len(records))
+        return future
+
+    def _commit(self, records: List[Record]):
+        """Write records to ChromaDB and, if used, the compact index"""
+        # Chroma expects documents for all records of an add or for none
+        with_documents = [r for r in records if r.document is not None]
+        without_documents = [r for r in records if r.document is None]
+        groups = ((with_documents, True), (without_documents, False))
+        for group, has_documents in groups:
+            if not group:
+                continue
+            ids = [r.id for r in group]
+            embeddings = [r.embedding for r in group]
+            self.collection.add(
+                embeddings=embeddings if self.index is None else [[0.0] for _ in ids],
+                documents=[r.document for r in group] if has_documents else None,
+                metadatas=[r.metadata for r in group],
+                ids=ids,
+            )
+            if self.index is not None:
+                with self._lock:
+                    self.index.add(ids, embeddings)
+        CHUNKS_INGESTED.inc(len(records))
+
+    def _nearest_distances(self, embeddings: list) -> List[Optional[float]]:
+        """
+        Distance of the closest stored chunk to each embedding (None if there
+        is none), looked up for all embeddings at once
+        """
+        # Snapshot the buffer first: a record committed while Chroma is queried
+        # is then found in the snapshot or in Chroma
+        pending = self.buffer.pending() if self.buffer is not None else []
+        if self.index is None:
+            # Compare with the Embedder's own vectors, re-embedding the texts with
+            # Chroma's model would differ slightly (e.g. for quantized models)
+            results = self.collection.query(
+                query_embeddings=list(embeddings), n_results=1, include=["distances"]
+            )["distances"]
+        else:
+            with self._lock:
+                results = [d for _, d in self.index.search_batch(embeddings, 1)]
+        distances = [d[0] if d else None for d in results]
+        if pending:
+            vectors = np.asarray([r.embedding for r in pending], dtype=np.float32)
+            for i, embedding in enumerate(embeddings):
+                query = np.asarray(embedding, dtype=np.float32)
+                buffered = float(np.square(vectors - query).sum(axis=1).min())
+                if distances[i] is None or buffered < distances[i]:
+                    distances[i] = buffered
+        return distances
+
+    def _query(self, query: str, n_results: int) -> Tuple[List[str], List[dict]]:
+        """Documents and metadatas of the chunks closest to the query"""
+        # Snapshot the buffer before querying Chroma, see _nearest_distance
+        pending = self.buffer.pending() if self.buffer is not None else []
+        if self.index is None and not pending:
+            results = self.collection.query(
+                query_texts=[query],
+                n_results=n_results,
+                include=["documents", "metadatas"],
+            )
+            return results["documents"][0], results["metadatas"][0]
+
+        query_embedding = self.embedding_function([query])[0]
+        if self.index is None:
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                include=["documents", "metadatas", "distances"],
+            )
+            hits = list(
+                zip(
+                    results["distances"][0],
+                    results["ids"][0],
+                    results["documents"][0],
+                    results["metadatas"][0],
+                )
+            )
+        else:
+            with self._lock:
+                ids, distances = self.index.search(query_embedding, n_results)
+            results = self.collection.get(ids=ids, include=["documents", "metadatas"])
+            records = {
+                id_: (document, metadata)
+                for id_, document, metadata in zip(
+                    results["ids"], results["documents"], results["metadatas"]
+                )
+            }
+            hits = [
+                (distance, id_, *records[id_])
+                for id_, distance in zip(ids, distances)
+                if id_ in records
+            ]
+
+        # Merge with chunks that are not committed yet
+        if pending:
+            hits += [
+                (distance, record.id, record.document, record.metadata)
+                for distance, record in WriteBuffer.nearest(
+                    pending, query_embedding, n_results
+                )
+            ]
+        hits.sort(key=lambda hit: hit[0])
+        found = {}
+        for _, id_, document, metadata in hits:
+            found.setdefault(id_, (document, metadata))
+        found = list(found.values())[:n_results]
+        return [r[0] for r in found], [r[1] for r in found]
+
+    def flush(self) -> Future:
+        """Commit all queued chunks, returns a Future of the commit"""
+        if self.buffer is None:
+            future = Future()
+            future.set_result(0)
+            return future
+        return self.buffer.flush()
+
+    def close(self):
+        """Commit all queued chunks and stop the write buffer"""
+        if self.buffer is not None:
+            self.buffer.close()
+
+    def _chunk_text(
+        self, document: Optional[str], metadata: dict, context_chars: int
+    ) -> str:
+        """Text of a result, read from the markdown store if it has a span"""
+        if "doc_id" not in metadata:
+            return document
+        return self.markdown_store.slice(
+            metadata["doc_id"],
+            metadata["start"] - context_chars,
+            metadata["end"] + context_chars,
+        )
+
+    @staticmethod
+    def _metadatas(
+        embeddings_data: dict, source_text: str, doc_id: Optional[str]
+    ) -> List[dict]:
+        if doc_id is None:
+            return [{"source": source_text} for _ in embeddings_data["chunks"]]
+        return [
+            {"source": source_text, "doc_id": doc_id, "start": start, "end": end}
+            for start, end in embeddings_data["spans"]
+        ]
 
-    def add_embeddings(self, embeddings_data: dict, source_text: str):
+    def add_document(self, markdown_text: str) -> str:
+        """
+        Store the markdown of a document, returns the doc_id to pass when
+        adding its embeddings
+        """
+        return self.markdown_store.put(markdown_text)
+
+    def add_embeddings(
+        self, embeddings_data: dict, source_text: str, doc_id: Optional[str] = None
+    ) -> Future:
         """
         Add embeddings to ChromaDB
         """
         id_ = uuid.uuid1()
-        self.collection.add(
-            embeddings=embeddings_data["embeddings"],
-            documents=embeddings_data["chunks"],
-            metadatas=[{"source": source_text} for _ in embeddings_data["chunks"]],
+        return self._add(
             ids=[f"{id_}-{i}" for i in range(len(embeddings_data["chunks"]))],
+            embeddings=embeddings_data["embeddings"],
+            documents=None if doc_id else embeddings_data["chunks"],
+            metadatas=self._metadatas(embeddings_data, source_text, doc_id),
         )
 
-    def add_unique_embeddings(self, embeddings_data: dict, source_text: str):
+    def add_unique_embeddings(
+        self, embeddings_data: dict, source_text: str, doc_id: Optional[str] = None
+    ) -> Future:
         """
         Add embeddings to ChromaDB if they are unique
         """
         embeddings = embeddings_data["embeddings"]
         documents = embeddings_data["chunks"]
-        metadatas = [{"source": source_text} for _ in embeddings_data["chunks"]]
+        metadatas = self._metadatas(embeddings_data, source_text, doc_id)
         ids = [f"{uuid.uuid1()}-{i}" for i in range(len(embeddings_data["chunks"]))]
 
         # Check if embeddings are unique
@@ -34,38 +328,63 @@ class VectorStore:
         unique_documents = []
         unique_metadatas = []
         unique_ids = []
-        for i, (embedding, document, metadata, id_) in enumerate(
-            zip(embeddings, documents, metadatas, ids)
-        ):
-            distance_to_chunk_in_collection = self.collection.query(
-                query_texts=[document], n_results=1
-            )["distances"][0]
-            if (
-                not distance_to_chunk_in_collection
-                or distance_to_chunk_in_collection[0] > 1e-3
+        with span("dedup", DEDUP_SECONDS):
+            distances = self._nearest_distances(embeddings) if len(embeddings) else []
+            for embedding, document, metadata, id_, distance in zip(
+                embeddings, documents, metadatas, ids, distances
             ):
-                unique_embeddings.append(embedding)
-                unique_documents.append(document)
-                unique_metadatas.append(metadata)
-                unique_ids.append(id_)
+                if distance is None or distance > 1e-3:
+                    unique_embeddings.append(embedding)
+                    unique_documents.append(document)
+                    unique_metadatas.append(metadata)
+                    unique_ids.append(id_)
 
         # Add unique embeddings to collection
-        if unique_embeddings:
-            self.collection.add(
-                embeddings=unique_embeddings,
-                documents=unique_documents,
-                metadatas=unique_metadatas,
-                ids=unique_ids,
-            )
+        future = self._add(
+            ids=unique_ids,
+            embeddings=unique_embeddings,
+            documents=None if doc_id else unique_documents,
+            metadatas=unique_metadatas,
+        )
+        logger.debug(
+            "Added %d of %d chunks from %s",
+            len(unique_ids),
+            len(ids),
+            source_text,
+        )
+        return future
+
+    def add_unique_embedding_batches(
+        self,
+        batches: Iterable[Dict[str, list]],
+        source_text: str,
+        doc_id: Optional[str] = None,
+    ) -> List[Future]:
+        """
+        Add batches of embeddings to ChromaDB as they are produced, so that
+        a large document is never held in memory as a whole. Returns the
+        Futures of the commits of all batches.
+        """
+        return [
+            self.add_unique_embeddings(batch, source_text, doc_id) for batch in batches
+        ]
 
-    def search(self, query: str, n_results: int = 10):
+    def search(
+        self, query: str, n_results: int = 10, context_chars: int = CONTEXT_CHARS
+    ):
         """
-        Search for relevant context using the query
+        Search for relevant context using the query, optionally expanding each
+        result by context_chars characters of the surrounding document
         """
-        results = self.collection.query(query_texts=[query], n_results=n_results)
+        with span("vector_search", SEARCH_SECONDS):
+            documents, metadatas = self._query(query, n_results)
 
-        print(results["metadatas"])
+        logger.debug("Search metadatas: %s", metadatas)
 
-        sources = [d.get("source", "") for d in results["metadatas"][0]]
+        context = [
+            self._chunk_text(document, metadata, context_chars)
+            for document, metadata in zip(documents, metadatas)
+        ]
+        sources = [d.get("source", "") for d in metadatas]
 
-        return results["documents"][0], sources
+        return context, sources
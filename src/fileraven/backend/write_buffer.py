@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Buffer writes to the vector store and commit them in groups
+WRITE_BUFFER = os.getenv("FILERAVEN_WRITE_BUFFER", "1").lower() in ("1", "true", "yes")
+# Commit as soon as this many records are pending
+FLUSH_RECORDS = int(os.getenv("FILERAVEN_FLUSH_RECORDS", "1024"))
+# Commit records at the latest this many seconds after they were added
+FLUSH_SECONDS = float(os.getenv("FILERAVEN_FLUSH_SECONDS", "0.2"))
+# Adds block while this many records (by default 2 * FLUSH_RECORDS) are pending
+MAX_PENDING = int(os.getenv("FILERAVEN_MAX_PENDING", "0")) or 2 * FLUSH_RECORDS
+
+
+class Record(NamedTuple):
+    """A chunk waiting to be written to the vector store"""
+
+    id: str
+    embedding: Sequence[float]
+    document: Optional[str]
+    metadata: dict
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer that groups the records of many ingestions into one
+    commit.
+
+    Records are committed by a background thread when FLUSH_RECORDS are
+    pending or the oldest record has waited FLUSH_SECONDS. Every add returns a
+    Future that completes once its records are committed (durably written by
+    the commit callback), or fails with the commit's exception. Until then the
+    records can be found with search, a brute-force delta index.
+
+    If commits are slower than records are added, add blocks while
+    max_pending records are waiting, so memory stays bounded.
+
+    Attributes:
+        max_records (int): Number of pending records that triggers a commit
+        max_delay (float): Maximum time in seconds a record stays pending
+        max_pending (int): Number of pending records above which add blocks
+    """
+
+    def __init__(
+        self,
+        commit: Callable[[List[Record]], None],
+        max_records: int = FLUSH_RECORDS,
+        max_delay: float = FLUSH_SECONDS,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, max_records)
+        self._commit = commit
+        self._records: List[Record] = []
+        self._futures: List[Future] = []
+        self._committing: List[Record] = []
+        self._oldest: Optional[float] = None
+        self._force = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="fileraven-write-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, records: List[Record]) -> Future:
+        """
+        Queue records, returns a Future completed when they are committed.
+        Blocks while max_pending records are waiting for their commit.
+        """
+        future = Future()
+        with self._condition:
+            while len(self._records) >= self.max_pending and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                raise RuntimeError("Write buffer is closed")
+            if not self._records:
+                self._oldest = time.monotonic()
+            self._records.extend(records)
+            self._futures.append(future)
+            self._condition.notify_all()
+        return future
+
+    def flush(self) -> Future:
+        """Commit all pending records now, returns a Future of that commit"""
+        future = Future()
+        with self._condition:
+            self._futures.append(future)
+            self._force = True
+            self._condition.notify_all()
+        return future
+
+    def _due(self) -> bool:
+        if self._force or len(self._records) >= self.max_records:
+            return True
+        return bool(self._records) and (
+            time.monotonic() - self._oldest >= self.max_delay
+        )
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not (self._due() or self._closed):
+                    timeout = None
+                    if self._records:
+                        timeout = self._oldest + self.max_delay - time.monotonic()
+                    self._condition.wait(timeout)
+                if self._closed and not self._records and not self._futures:
+                    return
+                records, futures = self._records, self._futures
+                self._records, self._futures = [], []
+                self._committing = records
+                self._force = False
+                # Wake adds waiting for room
+                self._condition.notify_all()
+
+            try:
+                if records:
+                    self._commit(records)
+            except Exception as error:
+                logger.exception("Committing %d records failed", len(records))
+                for future in futures:
+                    future.set_exception(error)
+            else:
+                for future in futures:
+                    future.set_result(len(records))
+            finally:
+                with self._condition:
+                    self._committing = []
+
+    def close(self) -> None:
+        """Commit everything that is pending and stop the background thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def pending(self) -> List[Record]:
+        """Snapshot of the records not yet committed"""
+        with self._condition:
+            return self._committing + self._records
+
+    @staticmethod
+    def nearest(
+        records: List[Record], query: Sequence[float], n_results: int = 10
+    ) -> List[tuple]:
+        """
+        Find the nearest records of a snapshot.
+
+        Returns:
+            List of (squared L2 distance, Record), nearest first
+        """
+        if not records:
+            return []
+        vectors = np.asarray([record.embedding for record in records], dtype=np.float32)
+        distances = np.square(vectors - np.asarray(query, dtype=np.float32)).sum(axis=1)
+        order = np.argsort(distances)[:n_results]
+        return [(float(distances[i]), records[i]) for i in order]
+
+    def search(self, query: Sequence[float], n_results: int = 10) -> List[tuple]:
+        """
+        Find the nearest not yet committed records.
+
+        Returns:
+            List of (squared L2 distance, Record), nearest first
+        """
+        return self.nearest(self.pending(), query, n_results)
+
+    def __len__(self) -> int:
+        """Number of records not yet committed"""
+        with self._condition:
+            return len(self._records) + len(self._committing)
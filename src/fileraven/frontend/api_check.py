@@ -1,11 +1,18 @@
+import asyncio
+import os
+import threading
 import time
-from functools import lru_cache
-from typing import Optional
+from typing import Dict, Optional
 from urllib.parse import urlparse
 
 import httpx
 import streamlit as st
 
+# Seconds a probe result is reused before the services are probed again
+HEALTH_TTL_SECONDS = float(os.getenv("FILERAVEN_HEALTH_TTL", "10"))
+# Timeout of a single probe in seconds
+HEALTH_TIMEOUT_SECONDS = float(os.getenv("FILERAVEN_HEALTH_TIMEOUT", "2"))
+
 
 class APICheckError(Exception):
     """Custom exception for API check failures"""
@@ -13,52 +20,143 @@ class APICheckError(Exception):
     pass
 
 
-@lru_cache(maxsize=1)
+async def _probe(client: httpx.AsyncClient, url: str) -> bool:
+    """
+    Probe one service. A URL with a path (a health endpoint) has to answer
+    with a success status, for a bare base URL any response counts.
+    """
+    try:
+        parsed_url = urlparse(url)
+        if not all([parsed_url.scheme, parsed_url.netloc]):
+            return False
+    except ValueError:
+        return False
+
+    try:
+        response = await client.get(url)
+    except httpx.HTTPError:
+        return False
+    if parsed_url.path.strip("/"):
+        return response.is_success
+    return True
+
+
+async def probe_services(
+    services: Dict[str, str], timeout: float = HEALTH_TIMEOUT_SECONDS
+) -> Dict[str, bool]:
+    """
+    Probe all services concurrently.
+
+    Args:
+        services: URL to probe per service name
+        timeout: Timeout of each probe in seconds
+
+    Returns:
+        Dict[str, bool]: Availability per service name
+    """
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        results = await asyncio.gather(
+            *(_probe(client, url) for url in services.values())
+        )
+    return dict(zip(services, results))
+
+
+class HealthCache:
+    """
+    Latest availability of a set of services.
+
+    get never waits for the network: it returns the last results and, if they
+    are older than ttl, starts a probe in a background thread. Services that
+    have not been probed yet are reported as None.
+
+    Attributes:
+        services (Dict[str, str]): URL to probe per service name
+        ttl (float): Seconds a result is considered fresh
+        timeout (float): Timeout of each probe in seconds
+    """
+
+    def __init__(
+        self,
+        services: Dict[str, str],
+        ttl: float = HEALTH_TTL_SECONDS,
+        timeout: float = HEALTH_TIMEOUT_SECONDS,
+    ):
+        self.services = services
+        self.ttl = ttl
+        self.timeout = timeout
+        self._results: Dict[str, Optional[bool]] = {name: None for name in services}
+        self._checked = float("-inf")
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def refresh(self) -> Dict[str, bool]:
+        """Probe all services now"""
+        results = asyncio.run(probe_services(self.services, self.timeout))
+        with self._lock:
+            self._results = dict(results)
+            self._checked = time.monotonic()
+            self._refreshing = False
+        return results
+
+    def get(self) -> Dict[str, Optional[bool]]:
+        """Last known availability, refreshed in the background when stale"""
+        with self._lock:
+            stale = time.monotonic() - self._checked > self.ttl
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_quietly, daemon=True).start()
+            return dict(self._results)
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            with self._lock:
+                self._refreshing = False
+
+
+@st.cache_data(ttl=HEALTH_TTL_SECONDS, show_spinner=False)
 def check_api_health(
     base_url: str,
     health_endpoint: Optional[str] = None,
-    max_retries: int = 3,
-    retry_delay: float = 1.0,
-    timeout: float = 5.0,
+    timeout: float = HEALTH_TIMEOUT_SECONDS,
 ) -> bool:
     """
     Check if an API service is reachable.
 
+    The result (also a failure) is cached for HEALTH_TTL_SECONDS.
+
     Args:
         base_url (str): The base URL of the API (e.g., "http://localhost:8000")
         health_endpoint (Optional[str]): Specific health check endpoint (e.g., "/health")
-        max_retries (int): Maximum number of retry attempts
-        retry_delay (float): Delay between retries in seconds
-        timeout (float): Timeout for each request in seconds
+        timeout (float): Timeout for the request in seconds
 
     Returns:
         bool: True if API is reachable, False otherwise
     """
     # Ensure base_url doesn't end with a slash
-    base_url = base_url.rstrip("/")
+    url = base_url.rstrip("/") + (health_endpoint if health_endpoint else "")
+    return asyncio.run(probe_services({url: url}, timeout))[url]
 
-    # Construct the full URL
-    url = base_url + (health_endpoint if health_endpoint else "")
 
-    # Parse URL to ensure it's valid
-    try:
-        parsed_url = urlparse(url)
-        if not all([parsed_url.scheme, parsed_url.netloc]):
-            return False
-    except ValueError:
-        return False
+def show_services_status(health: HealthCache) -> Dict[str, bool]:
+    """
+    Probe the services of a HealthCache now and show the result of each.
 
-    for attempt in range(max_retries):
-        try:
-            with httpx.Client(timeout=timeout) as client:
-                client.get(url)
-                # Consider any response (even errors) as indication that service is running
-                return True
-        except httpx.RequestError:
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            continue
-    return False
+    Args:
+        health: The services to probe, updated with the results
+
+    Returns:
+        Dict[str, bool]: Availability per service name
+    """
+    with st.spinner("Checking API availability..."):
+        results = health.refresh()
+    for name, available in results.items():
+        if available:
+            st.success(f"✅ {name} is available")
+        else:
+            st.error(f"⚠️ {name} is not reachable at {health.services[name]}.")
+    return results
 
 
 def assert_api_available(
@@ -77,7 +175,7 @@ def assert_api_available(
         error_message (Optional[str]): Custom error message to display if API is unavailable
 
     Raises:
-        APICheckError: If the API is not available after all retries
+        APICheckError: If the API is not available
     """
     check_url = base_url + (health_endpoint if health_endpoint else "")
     with st.spinner(f"Checking {api_name} API availability..."):
@@ -88,6 +186,7 @@ def assert_api_available(
                 """
             st.error(error_message or default_message)
             # raise APICheckError(f"{api_name} API is not available")
+            return
         st.success(f"✅ {api_name} API is available")
 
 
@@ -0,0 +1,77 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import httpx
+import streamlit as st
+
+# Configure API client
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+# Connections kept open to the API, shared by all sessions
+MAX_CONNECTIONS = int(os.getenv("FILERAVEN_UI_CONNECTIONS", "20"))
+# Show how long the reruns and API calls of the UI take
+DEBUG = os.getenv("FILERAVEN_DEBUG", "0").lower() in ("1", "true")
+# Number of reruns whose duration is kept for the timing overlay
+_TIMING_HISTORY = 50
+
+
+@st.cache_resource
+def get_client() -> httpx.Client:
+    """
+    Client of the FileRaven API.
+
+    Created once per process and shared by all sessions and reruns, so that
+    connections to the API are pooled and reused.
+    """
+    return httpx.Client(
+        base_url=API_URL,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+        ),
+        timeout=30.0,
+    )
+
+
+def start_rerun() -> None:
+    """Start timing a rerun of the script, call first thing in main"""
+    if DEBUG:
+        st.session_state.timings = []
+        st.session_state.rerun_start = time.perf_counter()
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Time a step of the rerun for the timing overlay (only in debug mode)"""
+    if not DEBUG:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        st.session_state.setdefault("timings", []).append(
+            (name, time.perf_counter() - start)
+        )
+
+
+def show_timings() -> None:
+    """Show the timings of this rerun in the sidebar, call last thing in main"""
+    if not DEBUG or "rerun_start" not in st.session_state:
+        return
+    total = time.perf_counter() - st.session_state.rerun_start
+    history = st.session_state.setdefault("rerun_history", [])
+    history.append(total)
+    del history[:-_TIMING_HISTORY]
+
+    with st.sidebar.expander("⏱ Timings", expanded=True):
+        st.caption(f"Rerun: {1000 * total:.1f} ms")
+        for name, duration in st.session_state.timings:
+            st.caption(f"{name}: {1000 * duration:.1f} ms")
+        slowest = max(history)
+        st.caption(
+            f"Last {len(history)} reruns: "
+            f"mean {1000 * sum(history) / len(history):.1f} ms, "
+            f"max {1000 * slowest:.1f} ms"
+        )
@@ -1,35 +1,75 @@
 import os
-import uuid
+from collections import OrderedDict
+from typing import List, Optional
 
+import httpx
 import streamlit as st
 
+# Bytes of downloaded documents kept per session to answer repeated clicks
+DOWNLOAD_CACHE_BYTES = int(os.getenv("FILERAVEN_DOWNLOAD_CACHE_BYTES", str(32 << 20)))
 
-@st.dialog("Downloads")
-def download_file():
-    sources = st.session_state.sources
-    for source in sources:
-        filepath = os.path.join(source)
-        filename = os.path.basename(filepath)
-        with open(filepath, "rb") as f:
-            # st.download_button('Download Docx', f, file_name='New_File.docx')
+
+def fetch_document(client: httpx.Client, document_id: str) -> Optional[bytes]:
+    """
+    Download a document from the API.
+
+    The most recently downloaded documents (up to DOWNLOAD_CACHE_BYTES) are
+    kept in the session with their ETag, so asking for one of them again only
+    costs a conditional request answered with 304.
+
+    Args:
+        client: Client of the FileRaven API
+        document_id: Id of the document
+
+    Returns:
+        Optional[bytes]: The document, None if it could not be downloaded
+    """
+    downloads = st.session_state.setdefault("downloads", OrderedDict())
+    cached = downloads.get(document_id)
+    headers = {"If-None-Match": cached["etag"]} if cached else {}
+
+    response = client.get(
+        f"/documents/{document_id}/content", headers=headers, timeout=600.0
+    )
+    if response.status_code == 304 and cached:
+        downloads.move_to_end(document_id)
+        return cached["data"]
+    if response.status_code != 200:
+        return None
+
+    downloads.pop(document_id, None)
+    data = response.content
+    if "etag" in response.headers and len(data) <= DOWNLOAD_CACHE_BYTES:
+        downloads[document_id] = {"etag": response.headers["etag"], "data": data}
+        # Drop the least recently used documents
+        while sum(len(d["data"]) for d in downloads.values()) > DOWNLOAD_CACHE_BYTES:
+            downloads.popitem(last=False)
+    return data
+
+
+def _document_buttons(client: httpx.Client, documents: List[dict]):
+    """One button per document, a document is only downloaded when clicked"""
+    for document in documents:
+        document_id, filename = document["id"], document["filename"]
+        if st.button(filename, key=f"fetch-{document_id}", use_container_width=True):
+            data = fetch_document(client, document_id)
+            if data is None:
+                st.error(f"Could not download {filename}")
+                continue
             st.download_button(
-                label=filename,
-                data=f,
+                label=f"Save {filename}",
+                data=data,
                 file_name=filename,
-                key=uuid.uuid1(),
+                key=f"save-{document_id}",
+                use_container_width=True,
             )
 
 
+@st.dialog("Downloads")
+def download_file(client: httpx.Client):
+    _document_buttons(client, st.session_state.sources)
+
+
 @st.dialog("Sources")
-def download_sources(sources: list):
-    for source in sources:
-        filepath = os.path.join(source)
-        filename = os.path.basename(filepath)
-        with open(filepath, "rb") as f:
-            # st.download_button('Download Docx', f, file_name='New_File.docx')
-            st.download_button(
-                label=filename,
-                data=f,
-                file_name=filename,
-                key=uuid.uuid1(),
-            )
+def download_sources(client: httpx.Client, documents: List[dict]):
+    _document_buttons(client, documents)
@@ -1,40 +1,48 @@
 import os
 import uuid
-
-# from typing import List
+from typing import Optional
 
 import httpx
 import streamlit as st
 
-from fileraven.frontend.api_check import assert_api_available
+from fileraven.frontend.api_check import HealthCache, show_services_status
+from fileraven.frontend.api_client import (
+    API_URL,
+    get_client,
+    show_timings,
+    start_rerun,
+    timed,
+)
 from fileraven.frontend.download_dialog import download_sources
 
+OLLAMA_URL = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+# Probed services, by name
+SERVICES = {
+    "FastAPI": API_URL + "/health",
+    "FileRaven ready": API_URL + "/ready",
+    "Ollama": OLLAMA_URL,
+}
+STATUS_ICONS = {None: "\u2754", True: "\U0001f7e2", False: "\U0001f534"}
+# Number of chat messages rendered, earlier ones are shown on request
+CHAT_WINDOW = int(os.getenv("FILERAVEN_CHAT_WINDOW", "50"))
+
+
+@st.cache_resource
+def get_health_cache() -> HealthCache:
+    """Availability of the services, shared by all sessions"""
+    return HealthCache(SERVICES)
 
-# Configure API client
-API_URL = os.getenv("API_URL", "http://localhost:8000")
 
 @st.dialog("API Availability")
 def check_api():
 
-    # Check FastAPI availability
-    assert_api_available(
-        api_name="FastAPI",
-        base_url="http://localhost:8000/",
-        error_message="""
-        ⚠️ FastAPI server is not running!
-        Please start the server using: uvicorn main:app --reload
-        """,
-    )
-
-    # Check Ollama availability without specific endpoint
-    assert_api_available(
-        api_name="Ollama",
-        base_url="http://localhost:11434",
-        error_message="""
-        ⚠️ Ollama service is not running!
-        Please start Ollama and ensure it's running properly.
-        """,
-    )
+    # Probe all services at once, including the readiness of the backend
+    results = show_services_status(get_health_cache())
+    if not results["FastAPI"]:
+        st.info("Start the FastAPI server using: fileraven-api")
+    if not results["Ollama"]:
+        st.info("Please start Ollama and ensure it's running properly.")
 
 
 @st.dialog("File Upload")
@@ -53,8 +61,37 @@ def upload_file(client: httpx.Client):
             st.error("Error processing document")
 
 
+def render_message(message: dict):
+    """Render one chat message, its widgets have keys stable across reruns"""
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        if message.get("documents"):
+            st.caption(message["sources_label"])
+            st.button(
+                "Sources",
+                key=f"sources-{message['id']}",
+                on_click=download_sources,
+                args=(get_client(), message["documents"]),
+            )
+
+
+def new_message(role: str, content: str, documents: Optional[list] = None) -> dict:
+    """
+    Create a chat message. The source listing is built once here instead of
+    on every rerun.
+    """
+    message = {"id": uuid.uuid4().hex, "role": role, "content": content}
+    if documents:
+        message["documents"] = documents
+        message["sources_label"] = "Sources: " + ", ".join(
+            document["filename"] for document in documents
+        )
+    return message
+
+
 def main():
     """Run the Streamlit application"""
+    start_rerun()
 
     with st.sidebar:
         button_check_api = st.button(
@@ -62,14 +99,17 @@ def main():
         )
         if button_check_api:
             check_api()
+        # Last known status, never waits for the probes
+        for name, available in get_health_cache().get().items():
+            st.caption(f"{STATUS_ICONS[available]} {name}")
 
-    client = httpx.Client(base_url=API_URL)
+    client = get_client()
 
     st.title("FileRaven - Document Q&A System")
 
     with st.sidebar:
         button_upload_file = st.button(
-            "\u2B06 \uFE0F Upload a document", use_container_width=True
+            "\u2b06 \ufe0f Upload a document", use_container_width=True
         )
         if button_upload_file:
             upload_file(client)
@@ -79,53 +119,50 @@ def main():
         st.session_state.messages = []
 
     if "sources" not in st.session_state:
-        st.session_state.sources = set()
-
-    # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            if "sources" in message:
-                st.button(
-                    "Sources",
-                    key=uuid.uuid1(),
-                    on_click=download_sources,
-                    args=(message["sources"],),
-                )
+        st.session_state.sources = []
+
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+
+    if "chat_window" not in st.session_state:
+        st.session_state.chat_window = CHAT_WINDOW
+
+    # Display the latest chat messages, older ones on request
+    with timed("render history"):
+        messages = st.session_state.messages
+        hidden = max(0, len(messages) - st.session_state.chat_window)
+        if hidden and st.button(f"Show {min(hidden, CHAT_WINDOW)} earlier messages"):
+            st.session_state.chat_window += CHAT_WINDOW
+            hidden = max(0, hidden - CHAT_WINDOW)
+        for message in messages[hidden:]:
+            render_message(message)
 
     # Chat input
     if prompt := st.chat_input("Ask a question about your documents"):
         # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
+        message = new_message("user", prompt)
+        st.session_state.messages.append(message)
+        render_message(message)
 
         # Get response
-        response = client.post("/query", json={"question": prompt}, timeout=630.0)
+        with timed("/query"):
+            response = client.post(
+                "/query",
+                json={"question": prompt, "session_id": st.session_state.session_id},
+                timeout=630.0,
+            )
 
         if response.status_code == 200:
-            assistant_response = response.json()["response"]
-            assistant_sources = set(response.json()["sources"])
-            st.session_state.messages.append(
-                {
-                    "role": "assistant",
-                    "content": assistant_response,
-                    "sources": assistant_sources,
-                }
+            message = new_message(
+                "assistant", response.json()["response"], response.json()["documents"]
             )
-            with st.chat_message("assistant"):
-                st.markdown(assistant_response)
-                if assistant_sources:
-                    st.button(
-                        "Sources",
-                        key=uuid.uuid1(),
-                        on_click=download_sources,
-                        args=(assistant_sources,),
-                    )
-        # )
+            st.session_state.messages.append(message)
+            render_message(message)
         else:
             st.error("Error getting response from backend")
 
+    show_timings()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+import random
+import re
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from fileraven.backend.embeddings import Embedder
+
+CHUNK_SIZE = 20
+# The reference recursion is cut off here, deeper it never terminates
+MAX_REFERENCE_DEPTH = 100
+
+# The regex cascade the Embedder split with before markdown_blocks
+REFERENCE_PATTERNS = [
+    (r"(?=^#{1,6}\s)", False),
+    (r"(?:^|\n)```[\s\S]*?```", True),
+    (r"(?:(?:^|\n)\|[^\n]*\|\s*\n\|[-:\|\s]*\|\s*\n(?:\|[^\n]*\|\s*\n)*)", True),
+    (r"(?:(?:^|\n)(?:[-*+]|\d+\.)\s+(?:(?!\n(?:[-*+]|\d+\.)\s).)*)", True),
+    (r"\n\n+", False),
+    (r"(?<=[:;.!?])\s+", False),
+]
+
+# Lines random documents are made of
+LINES = [
+    "# Title",
+    "## Section two",
+    "####### not a heading",
+    "| a | b |",
+    "|---|:-:|",
+    "| 1 | 2 |  ",
+    "|x|y|z|",
+    "```",
+    "```python",
+    "print('hello world')",
+    "- item one",
+    "* item. two",
+    "12. numbered item",
+    "1.not a list",
+    "A sentence. Another one! A question? Colon: semi; end.",
+    "Words without any punctuation at all in this line here",
+    " ".join(["long"] * 30) + ".",
+    " ".join(["run"] * 45),
+    "",
+    " ",
+    "\t",
+]
+
+
+class WhitespaceTokenizer:
+    """Stands in for the model's tokenizer, one token per word"""
+
+    def __call__(self, text, return_offsets_mapping=False):
+        return {"offset_mapping": [m.span() for m in re.finditer(r"\S+", text)]}
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def _count(text):
+    return len(text.split())
+
+
+def _reference_emergency_split(text):
+    chunks = []
+    current_chunk = ""
+    current_tokens = 0
+    for sentence in re.split(r"([.!?]\s+)", text):
+        sentence_tokens = _count(sentence)
+        if sentence_tokens > CHUNK_SIZE:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+                current_chunk = ""
+                current_tokens = 0
+            tokens = sentence.split()
+            for start in range(0, len(tokens), CHUNK_SIZE):
+                chunks.append(" ".join(tokens[start : start + CHUNK_SIZE]).strip())
+        elif current_tokens + sentence_tokens > CHUNK_SIZE:
+            chunks.append(current_chunk.strip())
+            current_chunk = sentence
+            current_tokens = sentence_tokens
+        else:
+            current_chunk += sentence
+            current_tokens += sentence_tokens
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def _reference_split_semantic(text, depth=0):
+    if depth > MAX_REFERENCE_DEPTH:
+        raise RecursionError
+    if not text.strip():
+        return []
+    if _count(text) <= CHUNK_SIZE:
+        return [text.strip()]
+    for pattern, is_separator in REFERENCE_PATTERNS:
+        pattern = f"({pattern})" if is_separator else pattern
+        pieces = re.split(pattern, text, flags=re.MULTILINE)
+        if len(pieces) > 1:
+            result = []
+            for piece in pieces:
+                if piece.strip():
+                    result.extend(_reference_split_semantic(piece, depth + 1))
+            return result
+    return _reference_emergency_split(text)
+
+
+def _reference_chunks(text):
+    """Chunks of the regex cascade, None where its recursion never ends"""
+    try:
+        semantic_chunks = _reference_split_semantic(text.strip())
+    except RecursionError:
+        return None
+    merged = []
+    current_chunks = []
+    current_tokens = 0
+    for chunk in semantic_chunks:
+        chunk_tokens = _count(chunk)
+        if current_tokens + chunk_tokens > CHUNK_SIZE and current_chunks:
+            merged.append("\n\n".join(current_chunks))
+            current_chunks = [current_chunks[-1], chunk]
+            current_tokens = _count(current_chunks[-2]) + chunk_tokens
+        else:
+            current_chunks.append(chunk)
+            current_tokens += chunk_tokens
+    if current_chunks:
+        merged.append("\n\n".join(current_chunks))
+    return merged
+
+
+@pytest.fixture
+def embedder():
+    embedder = Embedder.__new__(Embedder)
+    embedder.chunk_size = CHUNK_SIZE
+    embedder.overlap_size = 0
+    embedder.model = SimpleNamespace(tokenizer=WhitespaceTokenizer())
+    embedder._lock = threading.Lock()
+    return embedder
+
+
+def _documents(n):
+    rng = random.Random(0)
+    for _ in range(n):
+        separator = rng.choice(["\n", "\n\n", "\n \n"])
+        yield separator.join(rng.choice(LINES) for _ in range(rng.randint(0, 30)))
+
+
+def test_chunks_equal_reference(embedder):
+    compared = 0
+    for text in _documents(800):
+        expected = _reference_chunks(text)
+        if expected is None:
+            continue
+        compared += 1
+        chunks = list(embedder.iter_chunks(text))
+        assert [chunk.text for chunk in chunks] == expected, repr(text)
+    assert compared > 300
+
+
+def test_table_at_end_of_piece_stays_whole(embedder):
+    text = "# Table\n\n| a | b |\n|---|---|\n| 1 | 2 |\n\n" + "word " * 25
+    assert [chunk.text for chunk in embedder._split_semantic(text)][:2] == [
+        "# Table",
+        "| a | b |\n|---|---|\n| 1 | 2 |",
+    ]
+
+
+def test_chunk_spans_point_into_text(embedder):
+    for text in _documents(200):
+        text = text.strip()
+        for chunk in embedder._split_semantic(text):
+            # Chunks split by tokens are decoded with single spaces
+            covered = text[chunk.start : chunk.end]
+            assert covered.split() == chunk.text.split(), repr(text)
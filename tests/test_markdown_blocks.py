@@ -0,0 +1,89 @@
+import random
+import re
+import time
+
+import pytest
+
+from fileraven.backend import markdown_blocks
+
+# The regular expressions the scanners replace, in the order of LEVELS
+PATTERNS = [
+    r"(?=^#{1,6}\s)",
+    r"(?:^|\n)```[\s\S]*?```",
+    r"(?:(?:^|\n)\|[^\n]*\|\s*\n\|[-:\|\s]*\|\s*\n(?:\|[^\n]*\|\s*\n)*)",
+    r"(?:(?:^|\n)(?:[-*+]|\d+\.)\s+(?:(?!\n(?:[-*+]|\d+\.)\s).)*)",
+    r"\n\n+",
+    r"(?<=[:;.!?])\s+",
+]
+LEVELS = [
+    pytest.param(scanner, is_separator, pattern, id=scanner.__name__)
+    for (scanner, is_separator), pattern in zip(markdown_blocks.LEVELS, PATTERNS)
+]
+
+# Characters that drive the different scanners, mixed to hit their edge cases
+ALPHABETS = [
+    "|-: \na",
+    "#` \na\t",
+    "-*+1. \na2",
+    "\n .:!a?;",
+    "|-:#`*+1.\n \tab!?;:\x0b",
+    "``\n` a",
+]
+
+# Size of the pathological inputs and the time one level may take to split them
+PATHOLOGICAL_CHARS = 200_000
+TIME_LIMIT_SECONDS = 1.0
+
+# Inputs that make backtracking or rescanning scanners quadratic
+PATHOLOGICAL = {
+    "pipes": "|" * PATHOLOGICAL_CHARS,
+    "pipe rows without newline": "| a " * (PATHOLOGICAL_CHARS // 4),
+    "unclosed table separator": "|a|\n|" + "-" * PATHOLOGICAL_CHARS,
+    "unclosed fences": "\n```" * (PATHOLOGICAL_CHARS // 4),
+    "backticks": "`" * PATHOLOGICAL_CHARS,
+    "hashes": "#" * PATHOLOGICAL_CHARS,
+    "heading lines": "\n#" * (PATHOLOGICAL_CHARS // 2),
+    "digits": "\n" + "1" * PATHOLOGICAL_CHARS,
+    "list markers": "\n-" * (PATHOLOGICAL_CHARS // 2),
+    "whitespace": " \t" * (PATHOLOGICAL_CHARS // 2),
+    "newlines": "\n" * PATHOLOGICAL_CHARS,
+    "punctuation": ".:;!?" * (PATHOLOGICAL_CHARS // 5),
+    "punctuation and spaces": ". " * (PATHOLOGICAL_CHARS // 2),
+}
+
+
+def _re_split(pattern, is_separator, text):
+    return re.split(
+        f"({pattern})" if is_separator else pattern, text, flags=re.MULTILINE
+    )
+
+
+@pytest.mark.parametrize("scanner, is_separator, pattern", LEVELS)
+def test_split_equals_re_split(scanner, is_separator, pattern):
+    rng = random.Random(scanner.__name__)
+    for _ in range(5000):
+        alphabet = rng.choice(ALPHABETS)
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert list(markdown_blocks.split(text, scanner, is_separator)) == (
+            _re_split(pattern, is_separator, text)
+        ), repr(text)
+
+
+@pytest.mark.parametrize("scanner, is_separator", markdown_blocks.LEVELS)
+def test_split_spans_cover_text(scanner, is_separator):
+    text = "# Title\n\nSome text. More!\n\n| a | b |\n|---|---|\n| 1 | 2 |\n- item\n"
+    spans = list(markdown_blocks.split_spans(text, scanner, is_separator))
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(text)
+    assert all(end <= start for (_, end), (start, _) in zip(spans, spans[1:]))
+
+
+@pytest.mark.parametrize("name", PATHOLOGICAL)
+@pytest.mark.parametrize("scanner, is_separator, pattern", LEVELS)
+def test_pathological_input_time(scanner, is_separator, pattern, name):
+    text = PATHOLOGICAL[name]
+    start = time.perf_counter()
+    pieces = list(markdown_blocks.split_spans(text, scanner, is_separator))
+    elapsed = time.perf_counter() - start
+    assert pieces[-1][1] == len(text)
+    assert elapsed < TIME_LIMIT_SECONDS, f"{scanner.__name__} took {elapsed:.2f} s"